@@ -0,0 +1 @@
+../python/arith.py
\ No newline at end of file
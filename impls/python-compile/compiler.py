@@ -165,15 +165,28 @@ def _{prefix} ():
         compiled_string += \
 f"""
       _{prefix}_{i}(), # ast[{i}]"""
-    compiled_string += \
+    if len(ast) == 3:
+        # Two-argument calls of the arithmetic operators go straight to
+        # their binary entry points
+        compiled_string += \
+f"""
+    ]
+    from arith import binary
+    def {prefix} (env):
+        f = consts[0](env)
+        a, b = consts[1](env), consts[2](env)
+        op = binary.get(id(f))
+        result = op(a, b) if op else f(a, b)"""
+    else:
+        compiled_string += \
 f"""
     ]
     def {prefix} (env):
         result = consts[0](env) (
 """
-    for i in range(1, len(ast)):
-        compiled_string += f"          consts[{i}](env),\n"
-    compiled_string += "        )"
+        for i in range(1, len(ast)):
+            compiled_string += f"          consts[{i}](env),\n"
+        compiled_string += "        )"
     compiled_string += \
 f"""
         #logger.debug(f"result: {{result}}")
@@ -329,6 +342,42 @@ def quasiquote(ast):
     else:
         return ast
 
+# quasiquote builds the canonical expansion that quasiquoteexpand shows,
+# which conses every element of a template on each evaluation.  qq_lifted
+# is the one evaluated: parts of the template holding no unquote become
+# quoted literals, shared by every evaluation, and so does the constant
+# tail of a list.
+def qq_splice(elt):
+    return types._list_Q(elt) and len(elt) == 2 and elt[0] == u'splice-unquote'
+
+def qq_constant(ast):
+    if types._list_Q(ast) and len(ast) == 2 and ast[0] == u'unquote':
+        return False
+    if types._list_Q(ast) or types._vector_Q(ast):
+        return not any(qq_splice(elt) or not qq_constant(elt) for elt in ast)
+    return True
+
+def qq_lifted(ast):
+    if qq_constant(ast):
+        if (types._list_Q(ast) or types._vector_Q(ast) or
+                types._hash_map_Q(ast) or types._symbol_Q(ast)):
+            return types._list(types._symbol(u'quote'), ast)
+        return ast
+    if types._list_Q(ast) and len(ast) == 2 and ast[0] == u'unquote':
+        return ast[1]
+    i = len(ast)
+    while i > 0 and not qq_splice(ast[i-1]) and qq_constant(ast[i-1]):
+        i -= 1
+    if i < len(ast): acc = types._list(types._symbol(u'quote'), types._list(*ast[i:]))
+    else:            acc = types._list()
+    for elt in reversed(ast[:i]):
+        if qq_splice(elt):
+            acc = types._list(types._symbol(u'concat'), elt[1], acc)
+        else:
+            acc = types._list(types._symbol(u'cons'), qq_lifted(elt), acc)
+    if types._vector_Q(ast): return types._list(types._symbol(u'vec'), acc)
+    return acc
+
 def is_macro_call (ast, env):
     return (types._list_Q(ast) and
             types._symbol_Q(ast[0]) and
@@ -357,7 +406,7 @@ def COMPILE (ast, env, prefix="blk"):
         elif ast[0] == "quote":
             compiled_strings = compile_literal(ast[1], env, prefix)
         elif ast[0] == "quasiquote": # TODO Maybe do it with defmacro!
-            compiled_strings = COMPILE(quasiquote(ast[1]), env, prefix)
+            compiled_strings = COMPILE(qq_lifted(ast[1]), env, prefix)
         elif ast[0] == "quasiquoteexpand": # TODO Maybe do it with defmacro!
             compiled_strings = compile_literal(quasiquote(ast[1]), env, prefix)
         elif ast[0] == "macroexpand": # TODO Maybe do it with defmacro!
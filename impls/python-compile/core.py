@@ -1,9 +1,10 @@
-import copy, time
+import os, sys, copy, time, atexit
 from itertools import chain
 
 import mal_types as types
 from mal_types import MalException, List, Vector
 import mal_readline
+import arith
 import reader
 import printer
 
@@ -18,15 +19,75 @@ def pr_str(*args):
 def do_str(*args):
     return "".join(map(lambda exp: printer._pr_str(exp, False), args))
 
+# Output buffering
+# In batch mode prn/println output is gathered here and only written out
+# once it reaches the size limit, on (flush), before reading from stdin
+# and at exit.  In interactive mode every line is written out at once.
+class OutputBuffer():
+    def __init__(self, stream, batch=False, limit=65536):
+        self.stream = stream
+        self.batch = batch
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+
+    def write(self, s):
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.limit: self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+        self.stream.flush()
+
+output = OutputBuffer(sys.stdout,
+                      batch=os.environ.get('MAL_OUTPUT') == 'batch')
+atexit.register(output.flush)
+
+def flush():
+    output.flush()
+    return None
+
+def output_mode(mode=None):
+    if mode is not None:
+        if mode not in (_batch, _interactive):
+            throw("output-mode: expected :batch or :interactive")
+        output.flush()
+        output.batch = mode == _batch
+    return _batch if output.batch else _interactive
+_batch, _interactive = types._keyword('batch'), types._keyword('interactive')
+
+def readline(prompt):
+    output.flush()
+    return mal_readline.readline(prompt)
+
+def _print(args, print_readably):
+    for i, exp in enumerate(args):
+        if i: output.write(" ")
+        printer._pr_write(exp, output.write, print_readably)
+    output.write("\n")
+    if not output.batch: output.flush()
+
 def prn(*args):
-    print(" ".join(map(lambda exp: printer._pr_str(exp, True), args)))
+    _print(args, True)
     return None
 
 def println(*args):
-    print(" ".join(map(lambda exp: printer._pr_str(exp, False), args)))
+    _print(args, False)
     return None
 
 
+# Reader functions
+def ast_cache_stats():
+    stats = reader.ast_cache_stats
+    return types._hash_map(types._keyword('enabled'), bool(reader.ast_cache_dir),
+                           types._keyword('hits'), stats['hits'],
+                           types._keyword('misses'), stats['misses'])
+
+
 # Hash map functions
 def assoc(src_hm, *key_vals):
     hm = copy.copy(src_hm)
@@ -77,7 +138,12 @@ def count(lst):
     if types._nil_Q(lst): return 0
     else: return len(lst)
 
-def apply(f, *args): return f(*(list(args[0:-1])+args[-1]))
+def apply(f, *args):
+    args = list(args[0:-1])+args[-1]
+    # Two arguments go to the two-argument entry of an arith operator,
+    # as a call site of two would
+    if len(args) == 2: f = arith.binary.get(id(f), f)
+    return f(*args)
 
 def mapf(f, lst): return List(map(f, lst))
 
@@ -118,27 +184,12 @@ def reset_BANG(atm,val):
     atm.val = val
     return atm.val
 def swap_BANG(atm,f,*args):
-    atm.val = f(atm.val,*args)
+    if len(args) == 1: atm.val = arith.binary.get(id(f), f)(atm.val, args[0])
+    else:              atm.val = f(atm.val,*args)
     return atm.val
 
-# Arithmetics
-def subtract (args):
-    if len(args) == 0:
-        return 0
-    elif len(args) == 1:
-        return -args[0]
-    else:
-        return args[0] - sum(args[1:])
-def multiply (args):
-    if len(args) == 0:
-        return 1
-    elif len(args) == 1:
-        return args[0]
-    else:
-        return args[0] * multiply(args[1:])
-
 ns = { 
-        '=': types._equal_Q,
+        '=': arith.equal,
         'throw': throw,
         'nil?': types._nil_Q,
         'true?': types._true_Q,
@@ -158,17 +209,21 @@ ns = {
         'str': do_str,
         'prn': prn,
         'println': println,
-        'readline': lambda prompt: mal_readline.readline(prompt),
+        'readline': readline,
+        'flush': flush,
+        'output-mode': output_mode,
         'read-string': reader.read_str,
+        'read-file-data': reader.read_file_data,
+        'ast-cache-stats': ast_cache_stats,
         'slurp': lambda file: open(file).read(),
-        '<':  lambda a,b: a<b,
-        '<=': lambda a,b: a<=b,
-        '>':  lambda a,b: a>b,
-        '>=': lambda a,b: a>=b,
-        '+': lambda *args: sum(args),
-        '-': lambda *args: subtract(args),
-        '*': lambda *args: multiply(args),
-        '/': lambda a,b: int(a/b),
+        '<':  arith.lt,
+        '<=': arith.le,
+        '>':  arith.gt,
+        '>=': arith.ge,
+        '+':  arith.add,
+        '-':  arith.sub,
+        '*':  arith.mul,
+        '/':  arith.div,
         'time-ms': lambda : int(time.time() * 1000),
         'list': types._list,
         'list?': types._list_Q,
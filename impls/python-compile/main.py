@@ -1,6 +1,6 @@
-import sys, traceback, code, functools
+import os, sys, traceback, code
 import mal_types as types
-import mal_readline, reader, printer, core
+import reader, printer, core
 from env import Env
 from compiler import COMPILE, _consts
 from debugger import logger, DEBUG, TEST
@@ -24,22 +24,29 @@ def PRINT(exp):
 def REP(str):
     return PRINT(EVAL(READ(str), repl_env))
 
+def LOAD_FILE(path):
+    # Compile and run one top-level form at a time, so only the form at
+    # hand is ever held in memory.
+    for ast in reader.read_file_forms(path):
+        EVAL(ast, repl_env)
+    return None
+
 def REPL():
     logger.info(f"Hint: Use `{_wake_up_command}` to get into PYTHON.")
     while True:
         try:
-            line = mal_readline.readline(_lisp_prompt)
+            line = core.readline(_lisp_prompt)
             if line == None: break
             if line == "": continue
             if line == _wake_up_command:
                 logger.info(f"Hint: Use `LISP()` to get into LISP.")
                 break
-            print(REP(line))
+            print(REP(line), file=core.output)
         except reader.Blank: continue
         except types.MalException as e:
-            print("Error:", printer._pr_str(e.object))
+            print("Error:", printer._pr_str(e.object), file=core.output)
         except Exception as e:
-            print("".join(traceback.format_exception(*sys.exc_info())))
+            print("".join(traceback.format_exception(*sys.exc_info())), file=core.output)
 
 LISP = REPL
 
@@ -68,6 +75,7 @@ def compile_file (source_path, target_dir="/tmp/pymal/"):
                          "./reader.py",
                          "./printer.py",
                          "./core.py",
+                         "./arith.py",
                          "./env.py",
                          "./compiler.py",
                          "./debugger.py",
@@ -89,6 +97,7 @@ def compile_file (source_path, target_dir="/tmp/pymal/"):
 
 for k, v in core.ns.items(): repl_env.set(types._symbol(k), v)
 repl_env.set(types._symbol('eval'), lambda ast: EVAL(ast, repl_env))
+repl_env.set(types._symbol('load-file'), LOAD_FILE)
 repl_env.set(types._symbol('vector'), lambda *vector_elements: types.Vector(vector_elements))
 repl_env.set(types._symbol('hashmap'), lambda *dict_pairs: types.Hash_map()) # TODO FIXME
 repl_env.set(types._symbol('*ARGV*'), types._list(*sys.argv[2:]))
@@ -101,12 +110,14 @@ repl_env.set(types._symbol('test'), TEST)
 REP("(def! *host-language* \"python-compiled\")")
 REP("(def! not (fn* (a) (if a false true)))")
 REP("(def! read-file (fn* (f) (read-string (str \"(do \" (slurp f) \"\nnil)\"))))")
-REP("(def! load-file (fn* (f) (eval (read-file f))))")
 REP("(def! defmacro! (fn* (name function-body-ast) (list 'do (list 'def! name (list 'clone function-body-ast)) (list 'set-ismacro name))))") # TODO Rewrite after having quasiquote.
 REP("(set-ismacro defmacro!)")
 REP("(defmacro! cond (fn* (& xs) (if (> (count xs) 0) (list 'if (first xs) (if (> (count xs) 1) (nth xs 1) (throw \"odd number of forms to cond\")) (cons 'cond (rest (rest xs)))))))")
 
 if len(sys.argv) >= 2:
+    # A script's output is buffered unless it goes to a terminal
+    if 'MAL_OUTPUT' not in os.environ:
+        core.output.batch = not sys.stdout.isatty()
     REP('(load-file "' + sys.argv[1] + '")')
     sys.exit(0)
 
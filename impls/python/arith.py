@@ -0,0 +1,94 @@
+# Arithmetic and comparison, shared by the python and python-compile
+# implementations (python-compile/arith.py is a link to this file).
+#
+# Every operator is variadic as in Clojure: (+) is 0, (- x) is -x, (/ x)
+# is (/ 1 x) and comparisons hold when each argument is in order with the
+# next, (< 1 2 3).  The n-argument cases run in C (sum, math.prod,
+# reduce, map), so they are linear in n.  A Python function taking *args
+# still costs more to call than the two-argument lambdas it replaces, so
+# binary maps the id of each one to a two-argument callable that
+# evaluators, apply and swap! use when there are exactly two arguments.
+
+import math, operator
+from functools import reduce
+from itertools import islice
+
+import mal_types as types
+from mal_types import MalException
+
+def _arity_error(name, n):
+    raise MalException("%s: wrong number of arguments (%d)" % (name, n))
+
+def quot(a, b):
+    """Integer division truncating towards zero."""
+    if b == 0: raise MalException("division by zero")
+    q = abs(a) // abs(b)
+    return -q if (a < 0) != (b < 0) else q
+
+# Each operator takes its first two arguments as parameters and only the
+# rest as a tuple, which is empty for the usual two-argument call.  _none
+# stands for an argument that was not given where no default would do.
+_none = object()
+
+def _unary(name, a):
+    if a is _none: _arity_error(name, 0)
+    return True
+
+def add(a=0, b=0, *more):
+    if more: return a + b + sum(more)
+    return a + b
+
+def sub(a=_none, b=_none, *more):
+    if more: return a - b - sum(more)
+    if b is _none:
+        if a is _none: _arity_error('-', 0)
+        return -a
+    return a - b
+
+def mul(a=1, b=1, *more):
+    if more: return math.prod(more, start=a * b)
+    return a * b
+
+def div(a=_none, b=_none, *more):
+    if more: return reduce(quot, more, quot(a, b))
+    if b is _none:
+        if a is _none: _arity_error('/', 0)
+        return quot(1, a)
+    return quot(a, b)
+
+def _chain(op, a, b, more):
+    return op(a, b) and op(b, more[0]) and all(map(op, more, islice(more, 1, None)))
+
+def lt(a=_none, b=_none, *more):
+    if more: return _chain(operator.lt, a, b, more)
+    if b is _none: return _unary('<', a)
+    return a < b
+
+def le(a=_none, b=_none, *more):
+    if more: return _chain(operator.le, a, b, more)
+    if b is _none: return _unary('<=', a)
+    return a <= b
+
+def gt(a=_none, b=_none, *more):
+    if more: return _chain(operator.gt, a, b, more)
+    if b is _none: return _unary('>', a)
+    return a > b
+
+def ge(a=_none, b=_none, *more):
+    if more: return _chain(operator.ge, a, b, more)
+    if b is _none: return _unary('>=', a)
+    return a >= b
+
+def equal(a=_none, b=_none, *more):
+    if more: return _chain(types._equal_Q, a, b, more)
+    if b is _none: return _unary('=', a)
+    return types._equal_Q(a, b)
+
+ns = {'+': add, '-': sub, '*': mul, '/': div,
+      '<': lt, '<=': le, '>': gt, '>=': ge, '=': equal}
+
+binary = {id(add): operator.add, id(sub): operator.sub,
+          id(mul): operator.mul, id(div): quot,
+          id(lt): operator.lt, id(le): operator.le,
+          id(gt): operator.gt, id(ge): operator.ge,
+          id(equal): types._equal_Q}
@@ -0,0 +1,77 @@
+# Shared harness for the bench_*.py scripts.  A script either measures in
+# a child process, by re-running itself as "SCRIPT --child ARGS..." through
+# child(), or runs a mal program written by mal_program() on each engine
+# through run_mal().  Either way every measurement starts from a fresh
+# interpreter, so that one engine's heap, caches and peak RSS do not leak
+# into the next one's figures.
+
+import os, sys, time, subprocess, tempfile, contextlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COMPILE = os.path.join(os.path.dirname(HERE), 'python-compile')
+
+# (dotimes N F) calls F N times; (best N THUNK nil) is the least ms of N
+# calls of THUNK.
+PRELUDE = '''
+(def! dotimes (fn* [n f] (if (> n 0) (do (f) (dotimes (- n 1) f)) nil)))
+(def! best (fn* [n thunk acc]
+  (if (= n 0) acc
+    (let* [start (time-ms) _ (thunk) ms (- (time-ms) start)]
+      (best (- n 1) thunk (if (nil? acc) ms (if (< ms acc) ms acc)))))))
+'''
+
+# The functions of tests/perf2.mal, from tests/computations.mal
+COMPUTATIONS = [('fib 20', '(fib 20)'),
+                ('sumdown 250 x 100', '(dotimes 100 (fn* [] (sumdown 250)))')]
+
+def dispatch(main, child):
+    """Entry point of a script: child(*ARGS) under --child, else main()."""
+    if sys.argv[1:2] == ['--child']:
+        child(*sys.argv[2:])
+    else:
+        main()
+
+def arg(default):
+    return int(sys.argv[1]) if len(sys.argv) > 1 else default
+
+def child(script, *args, env=None):
+    """Run script's child(*args) in a fresh process; return it finished,
+    with stdout and stderr captured as text."""
+    return subprocess.run([sys.executable, script, '--child'] + [str(a) for a in args],
+                          cwd=HERE, env=dict(os.environ, **(env or {})),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+def run_mal(path, cwd=HERE, env=None, step='stepA_mal.py'):
+    """Output of the mal program at path run by step in cwd."""
+    return subprocess.check_output([sys.executable, step, path], cwd=cwd,
+                                   env=dict(os.environ, **(env or {})),
+                                   universal_newlines=True)
+
+@contextlib.contextmanager
+def mal_program(*parts):
+    """Path of a temporary file holding PRELUDE followed by parts."""
+    with tempfile.NamedTemporaryFile('w', suffix='.mal') as f:
+        f.write(PRELUDE)
+        f.write("\n".join(parts) + "\n")
+        f.flush()
+        yield f.name
+
+def computations(repeat):
+    """Program printing the best ms of repeat runs of each of COMPUTATIONS,
+    one per line."""
+    return mal_program('(load-file "../tests/computations.mal")',
+                       *['(println (best %d (fn* [] %s) nil))' % (repeat, expr)
+                         for _, expr in COMPUTATIONS])
+
+def best(f, n=5):
+    """Least ms of n calls of f."""
+    times = []
+    for i in range(n):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+def row(label, cells, first=16, width=20):
+    print("%-*s" % (first, label) + "".join("%*s" % (width, cell) for cell in cells))
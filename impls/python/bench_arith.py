@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Micro-benchmarks for arith: the cost of a two-argument call against the
+# lambdas core used to have, and how the variadic forms scale with the
+# number of arguments against python-compile's old subtract/multiply.
+#
+#   python bench_arith.py
+
+import sys, timeit
+import arith
+
+def old_subtract(args):
+    if len(args) == 0:
+        return 0
+    elif len(args) == 1:
+        return -args[0]
+    else:
+        return args[0] - sum(args[1:])
+
+def old_multiply(args):
+    if len(args) == 0:
+        return 1
+    elif len(args) == 1:
+        return args[0]
+    else:
+        return args[0] * old_multiply(args[1:])
+
+def ns_per_call(stmt, number, env):
+    return min(timeit.repeat(stmt, globals=env, number=number, repeat=5)) / number * 1e9
+
+def main():
+    env = dict(arith=arith, add=lambda a, b: a + b, lt=lambda a, b: a < b,
+               add_op=arith.binary[id(arith.add)], lt_op=arith.binary[id(arith.lt)],
+               old_subtract=old_subtract, old_multiply=old_multiply)
+    print("two arguments, ns per call")
+    for name, old, new, binary in (('+', 'add(3, 4)', 'arith.add(3, 4)', 'add_op(3, 4)'),
+                                   ('<', 'lt(3, 4)', 'arith.lt(3, 4)', 'lt_op(3, 4)')):
+        print("  %-2s lambda %5.0f   variadic %5.0f   binary entry %5.0f" % (
+            name, ns_per_call(old, 1000000, env), ns_per_call(new, 1000000, env),
+            ns_per_call(binary, 1000000, env)))
+
+    sys.setrecursionlimit(100000)
+    print("n arguments, us per call")
+    for n in (10, 100, 1000, 10000):
+        env['args'] = tuple(range(1, n + 1))
+        number = max(10, 100000 // n)
+        print("  n=%-6d - old %8.1f new %8.1f   * old %8.1f new %8.1f   < new %8.1f" % (
+            n, ns_per_call('old_subtract(args)', number, env) / 1000,
+            ns_per_call('arith.sub(*args)', number, env) / 1000,
+            ns_per_call('old_multiply(args)', number, env) / 1000,
+            ns_per_call('arith.mul(*args)', number, env) / 1000,
+            ns_per_call('arith.lt(*args)', number, env) / 1000))
+
+if __name__ == '__main__':
+    main()
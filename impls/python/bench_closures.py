@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# Create 10^6 closures, each over its own environment as (fn* [x] (fn* [] x))
+# does, with the slotted MalFunction/Env and with the function-object
+# closures and dict-based Env they replaced.  Then call each of them once.
+#
+#   python bench_closures.py [CLOSURES]
+#
+# Each representation runs in a fresh child process; memory is the growth
+# of peak RSS per closure, including its environment.
+
+import time, resource
+import bench
+
+class LegacyEnv():
+    def __init__(self, outer=None, binds=None, exprs=None):
+        self.data = {}
+        self.outer = outer or None
+        if binds:
+            for i in range(len(binds)):
+                self.data[binds[i]] = exprs[i]
+
+    def find(self, key):
+        if key in self.data: return self
+        elif self.outer:     return self.outer.find(key)
+        else:                return None
+
+    def get(self, key):
+        return self.find(key).data[key]
+
+def legacy_function(Eval, Env, ast, env, params):
+    import mal_types as types
+    def fn(*args):
+        return Eval(ast, Env(env, params, types.List(args)))
+    fn.__meta__ = None
+    fn.__ast__ = ast
+    fn.__gen_env__ = lambda args: Env(env, params, args)
+    return fn
+
+def child(mode, n):
+    n = int(n)
+    import mal_types as types
+    from env import Env
+    if mode == 'legacy':
+        Env, function = LegacyEnv, legacy_function
+    else:
+        function = types._function
+    EVAL = lambda ast, env: env.get(ast)
+    x = types._symbol('x')
+    root, params, outer_params = Env(), types._list(), types._list(x)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    fns = [function(EVAL, Env, x, Env(root, outer_params, [i]), params)
+           for i in range(n)]
+    created = time.time() - start
+    size = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+
+    start = time.time()
+    for f in fns: f()
+    called = time.time() - start
+    print("%d %d %d" % (size // n, created * 1000, called * 1000))
+
+def main():
+    n = bench.arg(1000000)
+    print("%d closures" % n)
+    for mode in ('legacy', 'slots'):
+        size, created, called = bench.child(__file__, mode, n).stdout.split()
+        print("%-7s %5s bytes/closure   create %6s ms   call %6s ms"
+              % (mode, size, created, called))
+
+if __name__ == '__main__':
+    bench.dispatch(main, child)
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# Time the evaluator on the functions of tests/perf2.mal: fib and sumdown
+# from tests/computations.mal.  step9_try keeps the evaluator stepA had
+# before lexical addressing, with environments as chains of dicts.
+#
+#   python bench_eval.py [REPEAT]
+#
+# Each evaluator runs in a fresh child process, and each workload is timed
+# REPEAT times, keeping the best.
+
+import bench
+
+ENGINES = [('step9_try (dict envs)', 'step9_try.py'),
+           ('stepA', 'stepA_mal.py')]
+
+def main():
+    repeat = bench.arg(5)
+    with bench.computations(repeat) as path:
+        bench.row("ms, best of %d" % repeat, [name for name, _ in bench.COMPUTATIONS],
+                  first=24)
+        for name, step in ENGINES:
+            bench.row(name, bench.run_mal(path, step=step).split(), first=24)
+
+if __name__ == '__main__':
+    main()
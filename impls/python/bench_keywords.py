@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Look up fields of keyword-keyed records and test keyword?, with Keyword
+# objects and with the "ʞ"-prefixed strings keywords used to be.
+#
+#   python bench_keywords.py [LOOKUPS]
+#
+# Each representation runs in a child process with the same hash seed, so
+# that both get maps of the same shape; times are the best of 5 runs.
+
+import sys
+import bench
+
+FIELDS = ['id', 'name', 'email', 'age', 'city', 'zip', 'tags', 'active']
+
+def child(mode, n):
+    n = int(n)
+    import mal_types as types
+    if mode == 'string':
+        key = lambda name: sys.intern(u"ʞ" + name)
+        is_key = lambda exp: (type(exp) in types.str_types and
+                              len(exp) != 0 and exp[0] == u"ʞ")
+    else:
+        key, is_key = types._keyword, types._keyword_Q
+    keys = [key(f) for f in FIELDS]
+    records = [types._hash_map(*[x for k in keys for x in (k, i)])
+               for i in range(1000)]
+
+    def gets():
+        total = 0
+        for i in range(n // len(keys)):
+            rec = records[i % 1000]
+            for k in keys:
+                total += rec.get(k)
+
+    def checks():
+        for i in range(n // len(keys)):
+            for k in keys:
+                if not is_key(k): raise Exception()
+
+    print("%d %d" % (bench.best(gets), bench.best(checks)))
+
+def main():
+    n = bench.arg(1000000)
+    print("%d lookups in %d-field records, %d keyword? checks" % (n, len(FIELDS), n))
+    for mode in ('string', 'keyword'):
+        p = bench.child(__file__, mode, n, env={'PYTHONHASHSEED': '0'})
+        get, check = p.stdout.split()
+        print("%-8s get %6s ms   keyword? %6s ms" % (mode, get, check))
+
+if __name__ == '__main__':
+    bench.dispatch(main, child)
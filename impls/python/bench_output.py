@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# Print 10^6 lines through println in interactive and batch output modes,
+# and through the plain print() calls println used to make.
+#
+#   python bench_output.py [LINES]
+#
+# Each mode runs in a child process whose stdout is a pipe drained by the
+# parent, the usual situation for batch jobs.
+
+import sys, time
+import bench
+
+def child(mode, lines):
+    lines = int(lines)
+    import core, printer, mal_types as types
+    line = types._list(1, "two", types._keyword('three'))
+    start = time.time()
+    if mode == 'print':
+        for i in range(lines):
+            print(" ".join(map(lambda exp: printer._pr_str(exp, False), (i, line))))
+    else:
+        core.output.batch = mode == 'batch'
+        for i in range(lines):
+            core.println(i, line)
+    core.flush()
+    sys.stderr.write("%d\n" % int((time.time() - start) * 1000))
+
+def main():
+    lines = bench.arg(1000000)
+    print("%d lines to a pipe" % lines)
+    for mode in ('print', 'interactive', 'batch'):
+        p = bench.child(__file__, mode, lines)
+        assert p.stdout.count("\n") == lines
+        print("%-12s %6s ms" % (mode, p.stderr.strip()))
+
+if __name__ == '__main__':
+    bench.dispatch(main, child)
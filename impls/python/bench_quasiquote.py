@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Evaluate quasiquote templates as their canonical expansion, the one
+# quasiquoteexpand shows and evaluation used before constant parts were
+# lifted, and as quasiquote itself, in both implementations.
+#
+#   python bench_quasiquote.py [N]
+#
+# "template" builds `(a b c ~x d e f (g h i) [j k]) N times.  "macro" runs
+# the body of lib/perf.mal's time macro N times, which is the work of
+# expanding N call sites.  Each implementation runs in a fresh child
+# process; each figure is the best of 5.
+
+import bench
+
+# (name, template, function evaluating it as ~body, call of that function f)
+TEMPLATES = [
+    ('template', '(a b c ~x d e f (g h i) [j k])',
+     '(fn* [x] ~body)', '(f 1)'),
+    ('macro', '(let* (~start (time-ms) ~ret ~exp) (do (println "Elapsed time:" '
+              '(- (time-ms) ~start) "msecs") ~ret))',
+     '(fn* [exp] (let* [start (gensym) ret (gensym)] ~body))', "(f '(+ 1 2))"),
+]
+
+IMPLS = [('python', bench.HERE), ('python-compile', bench.COMPILE)]
+
+def program(n):
+    lines = ['(load-file "../lib/trivial.mal")']
+    for name, template, fn, call in TEMPLATES:
+        for mode, body in (('canonical', "(quasiquoteexpand %s)" % template),
+                           ('lifted', "(list 'quasiquote '%s)" % template)):
+            lines.append("(def! f (eval (let* [body %s] `%s)))" % (body, fn))
+            lines.append('(println "%s %s" (best 5 (fn* [] (dotimes %d (fn* [] %s))) nil))'
+                         % (name, mode, n, call))
+    return bench.mal_program(*lines)
+
+def main():
+    n = bench.arg(20000)
+    with program(n) as path:
+        print("ms for %d evaluations" % n)
+        print("%-16s %-10s %10s %10s" % ("", "", "canonical", "lifted"))
+        for impl, cwd in IMPLS:
+            out = bench.run_mal(path, cwd)
+            ms = dict((tuple(l.split()[:2]), l.split()[2]) for l in out.splitlines())
+            for name, _, _, _ in TEMPLATES:
+                print("%-16s %-10s %10s %10s" % (impl, name, ms[name, 'canonical'],
+                                                 ms[name, 'lifted']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# Compare read-file-data against read-string on a large data file.
+#
+#   python bench_reader.py [TOKENS]
+#
+# Each reader runs in a fresh child process so that its peak RSS is not
+# polluted by the other one.
+
+import os, time, resource, tempfile
+import bench
+
+def child(mode, path):
+    import reader
+    start = time.time()
+    if mode == 'read_str':
+        ast = reader.read_str(open(path).read())
+    else:
+        ast = reader.read_file_data(path)
+    elapsed = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("%s %d %d" % (mode, int(elapsed * 1000), rss))
+
+def make_data(path, tokens):
+    # Roughly 16 tokens per record
+    with open(path, 'w') as f:
+        f.write("[\n")
+        for i in range(tokens // 16):
+            f.write('{:id %d :name "record %d" :tags [:a :b :c] '
+                    ':pos (%d %d) :ok true}\n' % (i, i, i, -i))
+        f.write("]\n")
+
+def main():
+    tokens = bench.arg(2000000)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.mal')
+        make_data(path, tokens)
+        print("data file: %d tokens, %d bytes" % (tokens, os.path.getsize(path)))
+        for mode in ('read_str', 'read_file_data'):
+            mode, ms, rss = bench.child(__file__, mode, path).stdout.split()
+            print("%-15s %6s ms   peak RSS %7d KiB" % (mode, ms, int(rss)))
+
+if __name__ == '__main__':
+    bench.dispatch(main, child)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# Side by side: stepA with each evaluator (MAL_EVAL unset, "stack" and
+# "vm") and python-compile, on tests/perf1.mal, perf2.mal and perf3.mal and
+# on fib and sumdown from tests/computations.mal.
+#
+#   python bench_vm.py [REPEAT]
+#
+# Each engine runs each program in a fresh child process.  perf1 and perf2
+# report the ms of a single run, perf3 the iterations it makes in 10
+# seconds (more is better), and the computations the best of REPEAT runs.
+
+import re
+import bench
+
+ENGINES = [('python', bench.HERE, {}),
+           ('python stack', bench.HERE, {'MAL_EVAL': 'stack'}),
+           ('python vm', bench.HERE, {'MAL_EVAL': 'vm'}),
+           ('python-compile', bench.COMPILE, {})]
+
+PERF = [('perf1 ms', '../tests/perf1.mal', r'Elapsed time: (\d+)'),
+        ('perf2 ms', '../tests/perf2.mal', r'Elapsed time: (\d+)'),
+        ('perf3 iters', '../tests/perf3.mal', r'iters over 10 seconds: (\d+)')]
+
+def main():
+    repeat = bench.arg(5)
+    with bench.computations(repeat) as path:
+        bench.row("", [name for name, _, _ in PERF] +
+                      ["%s ms" % name for name, _ in bench.COMPUTATIONS], width=22)
+        for name, cwd, env in ENGINES:
+            cells = [re.search(pattern, bench.run_mal(perf, cwd, env)).group(1)
+                     for _, perf, pattern in PERF]
+            bench.row(name, cells + bench.run_mal(path, cwd, env).split(), width=22)
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
-import copy, time
-from itertools import chain
+import os, sys, time, atexit
+from itertools import chain, count as counter, islice
 
 import mal_types as types
 from mal_types import MalException, List, Vector
 import mal_readline
+import arith
 import reader
 import printer
 
@@ -18,25 +19,85 @@ def pr_str(*args):
 def do_str(*args):
     return "".join(map(lambda exp: printer._pr_str(exp, False), args))
 
+# Output buffering
+# In batch mode prn/println output is gathered here and only written out
+# once it reaches the size limit, on (flush), before reading from stdin
+# and at exit.  In interactive mode every line is written out at once.
+class OutputBuffer():
+    def __init__(self, stream, batch=False, limit=65536):
+        self.stream = stream
+        self.batch = batch
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+
+    def write(self, s):
+        self.chunks.append(s)
+        self.size += len(s)
+        if self.size >= self.limit: self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+        self.stream.flush()
+
+output = OutputBuffer(sys.stdout,
+                      batch=os.environ.get('MAL_OUTPUT') == 'batch')
+atexit.register(output.flush)
+
+def flush():
+    output.flush()
+    return None
+
+def output_mode(mode=None):
+    if mode is not None:
+        if mode not in (_batch, _interactive):
+            throw("output-mode: expected :batch or :interactive")
+        output.flush()
+        output.batch = mode == _batch
+    return _batch if output.batch else _interactive
+_batch, _interactive = types._keyword('batch'), types._keyword('interactive')
+
+def readline(prompt):
+    output.flush()
+    return mal_readline.readline(prompt)
+
+def _print(args, print_readably):
+    for i, exp in enumerate(args):
+        if i: output.write(" ")
+        printer._pr_write(exp, output.write, print_readably)
+    output.write("\n")
+    if not output.batch: output.flush()
+
 def prn(*args):
-    print(" ".join(map(lambda exp: printer._pr_str(exp, True), args)))
+    _print(args, True)
     return None
 
 def println(*args):
-    print(" ".join(map(lambda exp: printer._pr_str(exp, False), args)))
+    _print(args, False)
     return None
 
 
+# Reader functions
+def ast_cache_stats():
+    stats = reader.ast_cache_stats
+    return types._hash_map(types._keyword('enabled'), bool(reader.ast_cache_dir),
+                           types._keyword('hits'), stats['hits'],
+                           types._keyword('misses'), stats['misses'])
+
+
 # Hash map functions
 def assoc(src_hm, *key_vals):
-    hm = copy.copy(src_hm)
-    for i in range(0,len(key_vals),2): hm[key_vals[i]] = key_vals[i+1]
+    hm = src_hm
+    for i in range(0,len(key_vals),2): hm = hm.assoc(key_vals[i], key_vals[i+1])
     return hm
 
 def dissoc(src_hm, *keys):
-    hm = copy.copy(src_hm)
+    hm = src_hm
     for key in keys:
-        hm.pop(key, None)
+        hm = hm.dissoc(key)
     return hm
 
 def get(hm, key):
@@ -55,11 +116,18 @@ def vals(hm): return types._list(*hm.values())
 # Sequence functions
 def coll_Q(coll): return sequential_Q(coll) or hash_map_Q(coll)
 
-def cons(x, seq): return List([x]) + List(seq)
+def cons(x, seq):
+    if types._list_Q(seq): return seq.cons(x)
+    if types._lazy_seq_Q(seq): return types.LazySeq._cell(x, seq)
+    return List(seq).cons(x)
 
 def concat(*lsts): return List(chain(*lsts))
 
 def nth(lst, idx):
+    if types._lazy_seq_Q(lst):
+        lst = lst.drop(idx)
+        if lst: return lst[0]
+        throw("nth: index out of range")
     if idx < len(lst): return lst[idx]
     else: throw("nth: index out of range")
 
@@ -69,24 +137,71 @@ def first(lst):
 
 def rest(lst):
     if types._nil_Q(lst): return List([])
+    elif types._list_Q(lst) or types._lazy_seq_Q(lst): return lst.rest()
     else: return List(lst[1:])
 
-def empty_Q(lst): return len(lst) == 0
+def empty_Q(lst): return not lst
 
 def count(lst):
     if types._nil_Q(lst): return 0
     else: return len(lst)
 
-def apply(f, *args): return f(*(list(args[0:-1])+args[-1]))
-
-def mapf(f, lst): return List(map(f, lst))
+def apply(f, *args):
+    args = list(args[0:-1])+list(args[-1])
+    # Two arguments go to the two-argument entry of an arith operator,
+    # as a call site of two would
+    if len(args) == 2: f = arith.binary.get(id(f), f)
+    return f(*args)
+
+# map, filter, take and drop are lazy over lazy seqs and eager over
+# realised collections, so that errors and side effects of mapping over a
+# list still happen where the map is called, e.g. inside try*.
+def mapf(f, lst):
+    if types._lazy_seq_Q(lst): return types._lazy_iter(map(f, lst))
+    return List(map(f, lst))
+
+def filterf(pred, lst):
+    def keep(x):
+        res = pred(x)
+        return res is not None and res is not False
+    if types._lazy_seq_Q(lst): return types._lazy_iter(filter(keep, lst))
+    return List(filter(keep, lst))
+
+def take(n, lst):
+    if types._nil_Q(lst): return List()
+    if types._lazy_seq_Q(lst): return types._lazy_iter(islice(lst, max(n, 0)))
+    return List(islice(lst, max(n, 0)))
+
+def drop(n, lst):
+    if types._nil_Q(lst): return List()
+    if types._lazy_seq_Q(lst): return types._lazy_seq(lambda: lst.drop(n))
+    if n <= 0: return lst if types._list_Q(lst) else List(lst)
+    return lst[n:] if types._list_Q(lst) else List(lst[n:])
+
+def rangef(*args):
+    if len(args) == 0: return types._lazy_iter(counter())
+    return types._lazy_iter(iter(range(*args)))
+
+def iterate(f, x):
+    def values(x):
+        while True:
+            yield x
+            x = f(x)
+    return types._lazy_iter(values(x))
+
+def lazy_seq(fn): return types._lazy_seq(fn)
 
 # retains metadata
 def conj(lst, *args):
     if types._list_Q(lst): 
-        new_lst = List(list(reversed(list(args))) + lst)
+        new_lst = lst
+        for x in args: new_lst = new_lst.cons(x)
+    elif types._lazy_seq_Q(lst):
+        new_lst = lst
+        for x in args: new_lst = types.LazySeq._cell(x, new_lst)
     else:
-        new_lst = Vector(lst + list(args))
+        new_lst = lst
+        for x in args: new_lst = new_lst.conj(x)
     if hasattr(lst, "__meta__"):
         new_lst.__meta__ = lst.__meta__
     return new_lst
@@ -96,6 +211,10 @@ def seq(obj):
         return obj if len(obj) > 0 else None
     elif types._vector_Q(obj):
         return List(obj) if len(obj) > 0 else None
+    elif types._lazy_seq_Q(obj):
+        return obj if obj else None
+    elif types._num_vector_Q(obj):
+        return List(obj) if len(obj) > 0 else None
     elif types._string_Q(obj):
         return List([c for c in obj]) if len(obj) > 0 else None
     elif obj == None:
@@ -112,18 +231,45 @@ def meta(obj):
     return getattr(obj, "__meta__", None)
 
 
+# Numeric vector functions
+def _num_vector_arg(name, v):
+    if not types._num_vector_Q(v): throw(name + ": expected a numeric vector")
+    return v
+
+def _elementwise(name):
+    def op(a, b):
+        if types._num_vector_Q(a): return a.binop(name, b)
+        if types._num_vector_Q(b): return b.binop(name, a, True)
+        throw("v" + name + ": expected a numeric vector")
+    return op
+
+def vsum(v): return _num_vector_arg('vsum', v).sum()
+
+def vmin(v): return _num_vector_arg('vmin', v).min()
+
+def vmax(v): return _num_vector_arg('vmax', v).max()
+
+def vdot(a, b):
+    return _num_vector_arg('vdot', a).dot(_num_vector_arg('vdot', b))
+
+def vslice(v, start, end=None): return _num_vector_arg('vslice', v)[start:end]
+
+def vmap(f, v): return _num_vector_arg('vmap', v).map(f)
+
+
 # Atoms functions
 def deref(atm):    return atm.val
 def reset_BANG(atm,val):
     atm.val = val
     return atm.val
 def swap_BANG(atm,f,*args):
-    atm.val = f(atm.val,*args)
+    if len(args) == 1: atm.val = arith.binary.get(id(f), f)(atm.val, args[0])
+    else:              atm.val = f(atm.val,*args)
     return atm.val
 
 
 ns = { 
-        '=': types._equal_Q,
+        '=': arith.equal,
         'throw': throw,
         'nil?': types._nil_Q,
         'true?': types._true_Q,
@@ -134,32 +280,47 @@ ns = {
         'symbol?': types._symbol_Q,
         'keyword': types._keyword,
         'keyword?': types._keyword_Q,
-        'fn?': lambda x: (types._function_Q(x) and not hasattr(x, '_ismacro_')),
-        'macro?': lambda x: (types._function_Q(x) and
-                             hasattr(x, '_ismacro_') and
-                             x._ismacro_),
+        'fn?': lambda x: types._function_Q(x) and not types._macro_Q(x),
+        'macro?': types._macro_Q,
 
         'pr-str': pr_str,
         'str': do_str,
         'prn': prn,
         'println': println,
-        'readline': lambda prompt: mal_readline.readline(prompt),
+        'readline': readline,
+        'flush': flush,
+        'output-mode': output_mode,
         'read-string': reader.read_str,
+        'read-file-data': reader.read_file_data,
+        'ast-cache-stats': ast_cache_stats,
         'slurp': lambda file: open(file).read(),
-        '<':  lambda a,b: a<b,
-        '<=': lambda a,b: a<=b,
-        '>':  lambda a,b: a>b,
-        '>=': lambda a,b: a>=b,
-        '+':  lambda a,b: a+b,
-        '-':  lambda a,b: a-b,
-        '*':  lambda a,b: a*b,
-        '/':  lambda a,b: int(a/b),
+        '<':  arith.lt,
+        '<=': arith.le,
+        '>':  arith.gt,
+        '>=': arith.ge,
+        '+':  arith.add,
+        '-':  arith.sub,
+        '*':  arith.mul,
+        '/':  arith.div,
         'time-ms': lambda : int(time.time() * 1000),
 
         'list': types._list,
         'list?': types._list_Q,
         'vector': types._vector,
         'vector?': types._vector_Q,
+        'num-vector': types._num_vector,
+        'num-vec': types.NumVector,
+        'num-vector?': types._num_vector_Q,
+        'v+': _elementwise('+'),
+        'v-': _elementwise('-'),
+        'v*': _elementwise('*'),
+        'v/': _elementwise('/'),
+        'vsum': vsum,
+        'vmin': vmin,
+        'vmax': vmax,
+        'vdot': vdot,
+        'vslice': vslice,
+        'vmap': vmap,
         'hash-map': types._hash_map,
         'map?': types._hash_map_Q,
         'assoc': assoc,
@@ -180,6 +341,13 @@ ns = {
         'count': count,
         'apply': apply,
         'map': mapf,
+        'filter': filterf,
+        'take': take,
+        'drop': drop,
+        'range': rangef,
+        'iterate': iterate,
+        'lazy-seq*': lazy_seq,
+        'lazy-seq?': types._lazy_seq_Q,
 
         'conj': conj,
         'seq': seq,
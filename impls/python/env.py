@@ -1,14 +1,20 @@
 # Environment
+import mal_types as types
+
+class Env(object):
+    # version counts the changes to data, so that a value looked up in
+    # data can be cached until the next def!
+    __slots__ = ('data', 'outer', 'version')
 
-class Env():
     def __init__(self, outer=None, binds=None, exprs=None):
         self.data = {}
         self.outer = outer or None
+        self.version = 0
 
         if binds:
             for i in range(len(binds)):
                 if binds[i] == "&":
-                    self.data[binds[i+1]] = exprs[i:]
+                    self.data[binds[i+1]] = types._list(*exprs[i:])
                     break
                 else:
                     self.data[binds[i]] = exprs[i]
@@ -20,9 +26,79 @@ class Env():
 
     def set(self, key, value):
         self.data[key] = value
+        self.version += 1
+        return value
+
+    def get(self, key):
+        env = self.find(key)
+        if not env: raise Exception("'" + key + "' not found")
+        return env.data[key]
+
+# Lexical frames
+# stepA resolves a form before evaluating it, and every symbol bound by an
+# enclosing fn*, let* or catch* becomes the (depth, slot) address of its
+# binding: depth counts the frames to walk out through, slot indexes the
+# list of values that frame holds.  A Scope names the slots of the frames
+# made for one fn*, let* or catch*, in slot order, and is shared by all of
+# them.  It is kept so that frames can still be searched by name, as
+# macroexpand and symbols read before their def! has run need.  The
+# outermost frame's outer is the global Env.
+
+unbound = object()  # value of a def! slot that has not been set yet
+
+class Scope(object):
+    # The first bound slots are set as soon as a frame is made: those of
+    # the names the Scope is made with, unless the resolver says otherwise.
+    # lazy is set once a macro call that is expanded only when it runs is
+    # resolved in the Scope, as the expansion may def! names not in it yet
+    __slots__ = ('names', 'index', 'outer', 'bound', 'lazy')
+
+    def __init__(self, names=(), outer=None):
+        self.names, self.index, self.outer = [], {}, outer
+        for name in names: self.add(name)
+        self.bound = len(self.names)
+        self.lazy = False
+
+    def add(self, name):
+        slot = self.index.get(name)
+        if slot is None:
+            slot = self.index[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+    def lookup(self, name):
+        depth, scope = 0, self
+        while scope is not None:
+            slot = scope.index.get(name)
+            if slot is not None: return depth, slot, slot < scope.bound
+            depth, scope = depth + 1, scope.outer
+        return None
+
+class Frame(object):
+    __slots__ = ('vals', 'outer', 'scope')
+
+    def __init__(self, outer, scope, vals):
+        self.vals, self.outer, self.scope = vals, outer, scope
+
+    def find(self, key):
+        env = self
+        while type(env) is Frame:
+            slot = env.scope.index.get(key)
+            if (slot is not None and slot < len(env.vals) and
+                    env.vals[slot] is not unbound):
+                return env
+            env = env.outer
+        return env.find(key)
+
+    def set(self, key, value):
+        slot = self.scope.add(key)
+        vals = self.vals
+        if slot >= len(vals): vals.extend([unbound] * (slot + 1 - len(vals)))
+        vals[slot] = value
         return value
 
     def get(self, key):
         env = self.find(key)
         if not env: raise Exception("'" + key + "' not found")
+        if type(env) is Frame: return env.vals[env.scope.index[key]]
         return env.data[key]
@@ -1,4 +1,10 @@
-import sys, copy, types as pytypes
+import sys, copy, array, operator, weakref, types as pytypes
+from itertools import chain, islice, zip_longest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # python 3.0 differences
 if sys.hexversion > 0x3000000:
@@ -17,30 +23,89 @@ else:
 # General functions
 
 def _equal_Q(a, b):
-    ota, otb = type(a), type(b)
-    if _string_Q(a) and _string_Q(b):
-        return a == b
-    if not (ota == otb or (_sequential_Q(a) and _sequential_Q(b))):
-        return False;
-    if _symbol_Q(a):
-        return a == b
-    elif _list_Q(a) or _vector_Q(a):
-        if len(a) != len(b): return False
-        for i in range(len(a)):
-            if not _equal_Q(a[i], b[i]): return False
-        return True
-    elif _hash_map_Q(a):
-        akeys = sorted(a.keys())
-        bkeys = sorted(b.keys())
-        if len(akeys) != len(bkeys): return False
-        for i in range(len(akeys)):
-            if akeys[i] != bkeys[i]: return False
-            if not _equal_Q(a[akeys[i]], b[bkeys[i]]): return False
-        return True
-    else:
-        return a == b
+    # Walks both values together from an explicit stack of iterators over
+    # pairs still to compare, so nesting depth costs no Python recursion.
+    # Values are dispatched on a small tag per type (see _eq_tags): values
+    # with different tags are never equal, except for the sequential types
+    # which share one.  A lazy seq is not counted first, as that realises
+    # all of it: the walk stops at the first element, or end, that differs.
+    stack = []
+    while True:
+        if a is not b:
+            tag = _eq_tags.get(type(a), _SCALAR)
+            if tag != _eq_tags.get(type(b), _SCALAR): return False
+            if tag == _SCALAR:
+                if type(a) != type(b) or not a == b: return False
+            elif tag == _SEQ:
+                if _hash_differs(a, b): return False
+                if type(a) is LazySeq or type(b) is LazySeq:
+                    stack.append(zip_longest(a, b, fillvalue=_missing))
+                else:
+                    if len(a) != len(b): return False
+                    stack.append(zip(a, b))
+            elif tag == _MAP:
+                if _hash_differs(a, b) or len(a) != len(b): return False
+                stack.append(_map_pairs(a, b))
+            elif not a == b:
+                return False
+        # Move on to the next pair of the innermost open collections
+        while stack:
+            pair = next(stack[-1], None)
+            if pair is None:
+                stack.pop()
+                continue
+            a, b = pair
+            if a is _missing or b is _missing: return False
+            break
+        else:
+            return True
+
+def _seq_eq(a, b):
+    # Python == between sequential types, without counting a lazy seq.
+    # Between Mal collections it is =, which keeps its own stack, so that
+    # deeply nested map keys compare without Python recursion.
+    if _eq_tags.get(type(b)) == _SEQ: return _equal_Q(a, b)
+    if type(a) is LazySeq:
+        return all(x is not _missing and y is not _missing and x == y
+                   for x, y in zip_longest(a, b, fillvalue=_missing))
+    return len(a) == len(b) and all(x == y for x, y in zip(a, b))
+
+def _map_pairs(a, b):
+    get = b.get
+    for k, v in a.items(): yield v, get(k, _missing)
+
+def _hash_differs(a, b):
+    # Only hashes already computed are compared, computing one costs as
+    # much as the comparison itself
+    ha, hb = getattr(a, '_hash', None), getattr(b, '_hash', None)
+    return ha is not None and hb is not None and ha != hb
+
+def _structural_hash(obj):
+    # A collection hashes as the tuple of its elements, or a map as the
+    # frozenset of its items, and keeps the hash in _hash.  The collections
+    # nested in it whose hash is not known yet are hashed first, innermost
+    # first from an explicit stack as in _equal_Q, so that hash() only ever
+    # goes one level down and nesting depth costs no Python recursion.
+    stack = [obj]
+    while stack:
+        coll = stack[-1]
+        if type(coll) is Hash_Map:
+            items = tuple(coll.items())
+            elements = tuple(chain.from_iterable(items))
+        else:
+            items = elements = tuple(coll)
+        if not _hash_cached.isdisjoint(map(type, elements)):
+            inner = [x for x in elements
+                     if type(x) in _hash_cached and getattr(x, '_hash', None) is None]
+            if inner:
+                stack.extend(inner)
+                continue
+        stack.pop()
+        if type(coll) is Hash_Map: coll._hash = hash(frozenset(items))
+        else:                      coll._hash = hash(items)
+    return obj._hash
 
-def _sequential_Q(seq): return _list_Q(seq) or _vector_Q(seq)
+def _sequential_Q(seq): return _list_Q(seq) or _vector_Q(seq) or _lazy_seq_Q(seq)
 
 def _clone(obj):
     #if type(obj) == type(lambda x:x):
@@ -68,78 +133,748 @@ class MalException(Exception):
 def _nil_Q(exp):    return exp is None
 def _true_Q(exp):   return exp is True
 def _false_Q(exp):  return exp is False
-def _string_Q(exp):
-    if type(exp) in str_types:
-        return len(exp) == 0 or exp[0] != _u("\u029e")
-    else:
-        return False
+def _string_Q(exp): return type(exp) in str_types
 def _number_Q(exp): return type(exp) == int
 
 # Symbols
-class Symbol(str): pass
-def _symbol(str): return Symbol(str)
+# Interned by name, so that every occurrence of a symbol is the same object
+# for as long as any of them is alive.  A copy, as with-meta makes, is a
+# new symbol of the same name that is not interned, so that its metadata
+# is its own; pickling interns again.
+class Symbol(str):
+    def __copy__(self): return Symbol(str(self))
+    def __reduce__(self): return (_symbol, (str(self),))
+_symbols = weakref.WeakValueDictionary()
+def _symbol(str):
+    sym = _symbols.get(str)
+    if sym is None:
+        sym = _symbols[str] = Symbol(str)
+    return sym
 def _symbol_Q(exp): return type(exp) == Symbol
 
 # Keywords
-# A specially prefixed string
-def _keyword(str):
-    if str[0] == _u("\u029e"): return str
-    else:                      return _u("\u029e") + str
-def _keyword_Q(exp):
-    if type(exp) in str_types:
-        return len(exp) != 0 and exp[0] == _u("\u029e")
-    else:
-        return False
+# Interned like symbols, so equality is identity.  The hash is computed
+# once, from the name with the prefix keywords used to carry as strings so
+# that it differs from the hash of the string of the same name, and is
+# read directly by the hash-map code.
+class Keyword(object):
+    __slots__ = ('name', '_hash', '__weakref__')
+
+    def __init__(self, name):
+        self.name = name
+        self._hash = hash(_u("\u029e") + name) & 0xFFFFFFFFFFFFFFFF
+
+    def __hash__(self): return self._hash
+    def __str__(self): return ':' + self.name
+    def __repr__(self): return ':' + self.name
+    def __reduce__(self): return (_keyword, (self.name,))
+_keywords = weakref.WeakValueDictionary()
+def _keyword(name):
+    if type(name) == Keyword: return name
+    kw = _keywords.get(name)
+    if kw is None:
+        kw = _keywords[name] = Keyword(name)
+    return kw
+def _keyword_Q(exp): return type(exp) == Keyword
 
 # Functions
+# A MalFunction is a closure created by fn*.  Evaluators call one in tail
+# position by evaluating its ast in a new Env of env binding params to
+# the arguments; other callers go through __call__, which does the same
+# with the Eval and Env class it was created with.
+class MalFunction(object):
+    __slots__ = ('ast', 'params', 'env', 'is_macro', '_eval', '_Env',
+                 '__meta__')
+
+    def __init__(self, Eval, Env, ast, env, params):
+        self._eval, self._Env = Eval, Env
+        self.ast, self.params, self.env = ast, params, env
+        self.is_macro = False
+
+    def __call__(self, *args):
+        return self._eval(self.ast, self._Env(self.env, self.params, args))
+
+    def __copy__(self):
+        new = MalFunction(self._eval, self._Env, self.ast, self.env, self.params)
+        new.is_macro = self.is_macro
+        return new
+
 def _function(Eval, Env, ast, env, params):
-    def fn(*args):
-        return Eval(ast, Env(env, params, List(args)))
-    fn.__meta__ = None
-    fn.__ast__ = ast
-    fn.__gen_env__ = lambda args: Env(env, params, args)
-    return fn
+    return MalFunction(Eval, Env, ast, env, params)
 def _function_Q(f):
     return callable(f)
+def _macro_Q(f):
+    return type(f) == MalFunction and f.is_macro
 
 # lists
-class List(list):
-    def __add__(self, rhs): return List(list.__add__(self, rhs))
+# A List is either a view of a tuple from some offset on, or a cons cell
+# holding its first element and the List of the rest.  rest and cons are
+# O(1) and allocate one object; indexing is O(1) on views and walks only
+# the leading cons cells otherwise.
+#
+# Lists, vectors, lazy seqs and hash-maps are never changed once built, so
+# they hash structurally and can be hash-map keys.  Sequences hash like
+# the tuple of their elements, so that = lists and vectors hash alike;
+# hash-maps hash like the frozenset of their entries.  A hash is computed
+# on first use and cached in the instance.
+class List(object):
+    __slots__ = ('_items', '_offset', '_head', '_tail', '_cnt', '_hash',
+                 '__meta__')
+
+    def __init__(self, vals=()):
+        items = vals if type(vals) is tuple else tuple(vals)
+        self._items, self._offset, self._cnt = items, 0, len(items)
+
+    @classmethod
+    def _view(cls, items, offset):
+        new = cls.__new__(cls)
+        new._items, new._offset, new._cnt = items, offset, len(items) - offset
+        return new
+
+    def cons(self, val):
+        """Return a new list of val followed by this list."""
+        new = List.__new__(List)
+        new._items, new._head, new._tail, new._cnt = None, val, self, self._cnt + 1
+        return new
+
+    def rest(self):
+        """Return the list without its first element."""
+        if self._items is None: return self._tail
+        if self._cnt == 0:      return List._view(self._items, self._offset)
+        return List._view(self._items, self._offset + 1)
+
+    def _cells(self):
+        lst = self
+        while lst._items is None:
+            yield lst._head
+            lst = lst._tail
+        for val in islice(lst._items, lst._offset, None): yield val
+
+    def __len__(self): return self._cnt
+
+    def __iter__(self):
+        if self._items is None: return self._cells()
+        if self._offset == 0:   return iter(self._items)
+        return islice(self._items, self._offset, None)
+
+    def __reversed__(self): return reversed(tuple(self))
+
     def __getitem__(self, i):
-        if type(i) == slice: return List(list.__getitem__(self, i))
-        elif i >= len(self): return None
-        else:                return list.__getitem__(self, i)
-    def __getslice__(self, *a): return List(list.__getslice__(self, *a))
+        if type(i) == slice: return self._slice(i)
+        if i < 0: i += self._cnt
+        if i >= self._cnt: return None
+        if i < 0: raise IndexError("list index out of range")
+        lst = self
+        while lst._items is None:
+            if i == 0: return lst._head
+            lst, i = lst._tail, i - 1
+        return lst._items[lst._offset + i]
+
+    def _slice(self, s):
+        start, stop, step = s.indices(self._cnt)
+        if step != 1 or stop != self._cnt: return List(tuple(self)[s])
+        lst = self
+        while start and lst._items is None:
+            lst, start = lst._tail, start - 1
+        if lst._items is not None:
+            return List._view(lst._items, lst._offset + start)
+        return copy.copy(lst) if lst is self else lst
+
+    def __add__(self, rhs): return List(chain(self, rhs))
+    def __radd__(self, lhs): return list(lhs) + list(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, List, Vector, LazySeq)):
+            return NotImplemented
+        return _seq_eq(self, other)
+    def __hash__(self):
+        try: return self._hash
+        except AttributeError: return _structural_hash(self)
+
+    def __copy__(self):
+        new = List.__new__(List)
+        new._items, new._cnt = self._items, self._cnt
+        if self._items is None: new._head, new._tail = self._head, self._tail
+        else:                   new._offset = self._offset
+        return new
+
+    def __reduce__(self): return (List, (tuple(self),))
+    def __repr__(self): return repr(list(self))
 def _list(*vals): return List(vals)
 def _list_Q(exp):   return type(exp) == List
 
 
+# lazy sequences
+# A LazySeq holds a function of no arguments returning a seq (nil, a
+# collection or another LazySeq).  The function is called the first time
+# the LazySeq is looked at, and the LazySeq then becomes a cell holding
+# the first element and the seq of the rest; _rest is None once realised
+# iff the seq is empty.  Walking a LazySeq only keeps the current cell
+# alive, so a pipeline nobody holds the head of runs in constant memory.
+class LazySeq(object):
+    __slots__ = ('_fn', '_first', '_rest', '_hash', '__meta__')
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    @classmethod
+    def _cell(cls, first, rest):
+        new = cls.__new__(cls)
+        new._fn, new._first, new._rest = None, first, rest
+        return new
+
+    def _realize(self):
+        # Functions returning further unrealised LazySeqs are unwrapped in
+        # a loop, and all of them are set to the same cell
+        pending = [self]
+        s = self._fn()
+        while type(s) is LazySeq and s._fn is not None:
+            pending.append(s)
+            s = s._fn()
+        if type(s) is LazySeq:
+            first, rest = s._first, s._rest
+        elif s is None or len(s) == 0:
+            first, rest = None, None
+        elif type(s) is List:
+            first, rest = s[0], s.rest()
+        elif type(s) is Vector or type(s) in str_types:
+            items = tuple(s)
+            first, rest = items[0], List._view(items, 1)
+        else:
+            raise MalException("lazy-seq: expected a sequence")
+        for node in pending:
+            node._first, node._rest, node._fn = first, rest, None
+
+    def first(self):
+        if self._fn is not None: self._realize()
+        return self._first
+
+    def rest(self):
+        """Return the seq without its first element."""
+        if self._fn is not None: self._realize()
+        return List() if self._rest is None else self._rest
+
+    def drop(self, n):
+        """Return the seq without its first n elements."""
+        s = self
+        while n > 0 and type(s) is LazySeq:
+            if s._fn is not None: s._realize()
+            if s._rest is None: return s
+            s, n = s._rest, n - 1
+        if n <= 0: return s
+        return s[n:] if type(s) is List else List(tuple(s)[n:])
+
+    def __bool__(self):
+        if self._fn is not None: self._realize()
+        return self._rest is not None
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        n = 0
+        for _ in self: n += 1
+        return n
+
+    def __iter__(self): return _lazy_walk(self)
+
+    def __getitem__(self, i):
+        if type(i) == slice: return List(tuple(self)[i])
+        if i < 0: return tuple(self)[i]
+        s = self.drop(i)
+        return s.first() if type(s) is LazySeq else s[0]
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, List, Vector, LazySeq)):
+            return NotImplemented
+        return _seq_eq(self, other)
+    def __hash__(self):
+        try: return self._hash
+        except AttributeError: return _structural_hash(self)
+
+    def __copy__(self):
+        if self._fn is not None: self._realize()
+        return LazySeq._cell(self._first, self._rest)
+
+    def __reduce__(self): return (List, (tuple(self),))
+    def __repr__(self): return repr(list(self))
+
+def _lazy_walk(s):
+    # s is rebound as the walk goes, so the head is not kept alive here
+    while type(s) is LazySeq:
+        if s._fn is not None: s._realize()
+        if s._rest is None: return
+        yield s._first
+        s = s._rest
+    for val in s: yield val
+
+def _lazy_iter(it):
+    """Return a LazySeq of the values of the iterator it."""
+    # The iterator has moved past a value it failed to produce, so the
+    # exception is kept and raised again each time the cell is realised
+    error = None
+    def step():
+        nonlocal error
+        if error is not None: raise error.with_traceback(None)
+        try:
+            for val in it: return LazySeq._cell(val, _lazy_iter(it))
+        except Exception as e:
+            error = e
+            raise
+        return None
+    return LazySeq(step)
+
+def _lazy_seq(fn):     return LazySeq(fn)
+def _lazy_seq_Q(exp):  return type(exp) == LazySeq
+
 # vectors
-class Vector(list):
-    def __add__(self, rhs): return Vector(list.__add__(self, rhs))
+# A persistent vector: a trie of 32-way Python lists holding all but the
+# last (at most 32) elements, which live in a separate tail.  Appending
+# copies at most the tail or one path of the trie, and every version
+# shares the rest of its structure with the vector it was built from.
+_BITS, _WIDTH, _MASK = 5, 32, 31
+
+def _new_path(level, node):
+    while level > 0:
+        node = [node]
+        level -= _BITS
+    return node
+
+def _push_tail(cnt, level, parent, tail):
+    sub = ((cnt - 1) >> level) & _MASK
+    node = list(parent)
+    if level == _BITS:        child = tail
+    elif sub < len(parent):   child = _push_tail(cnt, level - _BITS, parent[sub], tail)
+    else:                     child = _new_path(level - _BITS, tail)
+    if sub < len(node): node[sub] = child
+    else:               node.append(child)
+    return node
+
+def _assoc_path(level, node, i, val):
+    node = list(node)
+    if level == 0:
+        node[i & _MASK] = val
+    else:
+        sub = (i >> level) & _MASK
+        node[sub] = _assoc_path(level - _BITS, node[sub], i, val)
+    return node
+
+class Vector(object):
+    __slots__ = ('_cnt', '_shift', '_root', '_tail', '_hash', '__meta__')
+
+    def __init__(self, vals=()):
+        vals = list(vals)
+        cnt = len(vals)
+        tail_off = ((cnt - 1) >> _BITS) << _BITS if cnt else 0
+        nodes = [vals[i:i+_WIDTH] for i in range(0, tail_off, _WIDTH)]
+        shift = _BITS
+        while len(nodes) > _WIDTH:
+            nodes = [nodes[i:i+_WIDTH] for i in range(0, len(nodes), _WIDTH)]
+            shift += _BITS
+        self._cnt, self._shift, self._root = cnt, shift, nodes
+        self._tail = vals[tail_off:]
+
+    @classmethod
+    def _make(cls, cnt, shift, root, tail):
+        new = cls.__new__(cls)
+        new._cnt, new._shift, new._root, new._tail = cnt, shift, root, tail
+        return new
+
+    def _leaf(self, i):
+        if i >= self._cnt - len(self._tail): return self._tail
+        node = self._root
+        for level in range(self._shift, 0, -_BITS):
+            node = node[(i >> level) & _MASK]
+        return node
+
+    def conj(self, val):
+        """Return a new vector with val appended."""
+        cnt, shift, tail = self._cnt, self._shift, self._tail
+        if len(tail) < _WIDTH:
+            return self._make(cnt + 1, shift, self._root, tail + [val])
+        if (cnt >> _BITS) > (1 << shift):
+            root = [self._root, _new_path(shift, tail)]
+            shift += _BITS
+        else:
+            root = _push_tail(cnt, shift, self._root, tail)
+        return self._make(cnt + 1, shift, root, [val])
+
+    def assoc_n(self, i, val):
+        """Return a new vector with the element at index i replaced by val
+        (or appended, when i is the length of the vector)."""
+        cnt = self._cnt
+        if i == cnt: return self.conj(val)
+        if not 0 <= i < cnt: raise IndexError("vector index out of range")
+        tail_off = cnt - len(self._tail)
+        if i >= tail_off:
+            tail = list(self._tail)
+            tail[i - tail_off] = val
+            return self._make(cnt, self._shift, self._root, tail)
+        return self._make(cnt, self._shift,
+                          _assoc_path(self._shift, self._root, i, val),
+                          self._tail)
+
+    def __len__(self): return self._cnt
+
+    def __iter__(self):
+        leaves = map(self._leaf, range(0, self._cnt - len(self._tail), _WIDTH))
+        return chain(chain.from_iterable(leaves), self._tail)
+
+    def __reversed__(self): return reversed(list(self))
+
     def __getitem__(self, i):
-        if type(i) == slice: return Vector(list.__getitem__(self, i))
-        elif i >= len(self): return None
-        else:                return list.__getitem__(self, i)
-    def __getslice__(self, *a): return Vector(list.__getslice__(self, *a))
+        if type(i) == slice: return Vector(list(self)[i])
+        if i < 0: i += self._cnt
+        if i >= self._cnt: return None
+        if i < 0: raise IndexError("vector index out of range")
+        return self._leaf(i)[i & _MASK]
+
+    def __add__(self, rhs): return Vector(chain(self, rhs))
+    def __radd__(self, lhs): return list(lhs) + list(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, List, Vector, LazySeq)):
+            return NotImplemented
+        return _seq_eq(self, other)
+    def __hash__(self):
+        try: return self._hash
+        except AttributeError: return _structural_hash(self)
+
+    def __copy__(self):
+        return self._make(self._cnt, self._shift, self._root, self._tail)
+
+    def __reduce__(self): return (Vector, (list(self),))
+    def __repr__(self): return repr(list(self))
 def _vector(*vals): return Vector(vals)
 def _vector_Q(exp): return type(exp) == Vector
 
 # Hash maps
-class Hash_Map(dict): pass
+# Keys are found through a persistent hash array mapped trie.  Each _Node
+# level consumes five bits of the key's hash: its bitmap tells which of
+# the 32 slots are in use and array holds only those, as (key, value)
+# leaves or sub-nodes.  Keys whose full hashes are equal share a
+# _Collision node.  assoc and dissoc copy one path of at most 13 small
+# arrays and share everything else.
+class _Node(object):
+    __slots__ = ('bitmap', 'array')
+    def __init__(self, bitmap, array):
+        self.bitmap, self.array = bitmap, array
+
+class _Collision(object):
+    __slots__ = ('hash', 'entries')
+    def __init__(self, hash, entries):
+        self.hash, self.entries = hash, entries
+
+_EMPTY_NODE = _Node(0, [])
+_missing = object()
+
+def _hash(key):
+    if type(key) is Keyword: return key._hash
+    return hash(key) & 0xFFFFFFFFFFFFFFFF
+
+def _node_get(node, h, key, default):
+    shift = 0
+    while True:
+        if type(node) is _Collision:
+            for k, v in node.entries:
+                if k == key: return v
+            return default
+        bit = 1 << ((h >> shift) & _MASK)
+        if not node.bitmap & bit: return default
+        e = node.array[(node.bitmap & (bit - 1)).bit_count()]
+        if type(e) is tuple:
+            return e[1] if e[0] is key or e[0] == key else default
+        node, shift = e, shift + _BITS
+
+def _merge(shift, e1, h1, e2, h2):
+    if h1 == h2: return _Collision(h1, [e1, e2])
+    i1, i2 = (h1 >> shift) & _MASK, (h2 >> shift) & _MASK
+    if i1 == i2: return _Node(1 << i1, [_merge(shift + _BITS, e1, h1, e2, h2)])
+    return _Node((1 << i1) | (1 << i2), [e1, e2] if i1 < i2 else [e2, e1])
+
+def _node_assoc(node, shift, h, key, val):
+    # Returns the new node, and whether key was not there before
+    if type(node) is _Collision:
+        if h == node.hash:
+            entries = list(node.entries)
+            for i, (k, v) in enumerate(entries):
+                if k == key:
+                    entries[i] = (key, val)
+                    return _Collision(h, entries), False
+            entries.append((key, val))
+            return _Collision(h, entries), True
+        node = _Node(1 << ((node.hash >> shift) & _MASK), [node])
+    bitmap, array = node.bitmap, node.array
+    bit = 1 << ((h >> shift) & _MASK)
+    idx = (bitmap & (bit - 1)).bit_count()
+    if not bitmap & bit:
+        return _Node(bitmap | bit, array[:idx] + [(key, val)] + array[idx:]), True
+    e = array[idx]
+    if type(e) is tuple:
+        if e[0] is key or e[0] == key:
+            if e[1] is val: return node, False
+            new, added = (key, val), False
+        else:
+            new, added = _merge(shift + _BITS, e, _hash(e[0]), (key, val), h), True
+    else:
+        new, added = _node_assoc(e, shift + _BITS, h, key, val)
+        if new is e: return node, False
+    array = list(array)
+    array[idx] = new
+    return _Node(bitmap, array), added
+
+def _node_dissoc(node, shift, h, key):
+    # Returns the node without key: node itself when key is absent, None
+    # when nothing is left, or a lone leaf to be pulled up by the parent
+    if type(node) is _Collision:
+        entries = [e for e in node.entries if e[0] != key]
+        if len(entries) == len(node.entries): return node
+        if len(entries) == 1: return entries[0]
+        return _Collision(node.hash, entries)
+    bitmap, array = node.bitmap, node.array
+    bit = 1 << ((h >> shift) & _MASK)
+    if not bitmap & bit: return node
+    idx = (bitmap & (bit - 1)).bit_count()
+    e = array[idx]
+    if type(e) is tuple:
+        if e[0] != key: return node
+        new = None
+    else:
+        new = _node_dissoc(e, shift + _BITS, h, key)
+        if new is e: return node
+        if type(new) is _Node and len(new.array) == 1 \
+           and type(new.array[0]) is tuple:
+            new = new.array[0]
+    if new is None:
+        if bitmap == bit: return None
+        return _Node(bitmap ^ bit, array[:idx] + array[idx+1:])
+    array = list(array)
+    array[idx] = new
+    return _Node(bitmap, array)
+
+# The map itself pairs such a trie, which maps each key to a position,
+# with a persistent vector of (key, value) entries in insertion order, as
+# dict iterates.  Removed entries leave a tombstone in the vector until
+# they outnumber the live ones and the map is rebuilt.
+class Hash_Map(object):
+    __slots__ = ('_index', '_entries', '_cnt', '_hash', '__meta__')
+
+    def __init__(self, items=()):
+        if isinstance(items, (dict, Hash_Map)): items = items.items()
+        index, entries = _EMPTY_NODE, []
+        for k, v in items:
+            h = _hash(k)
+            i = _node_get(index, h, k, _missing)
+            if i is _missing:
+                index, _ = _node_assoc(index, 0, h, k, len(entries))
+                entries.append((k, v))
+            else:
+                entries[i] = (entries[i][0], v)
+        self._index, self._entries = index, Vector(entries)
+        self._cnt = len(entries)
+
+    def _derive(self, index, entries, cnt):
+        # A new version of this map, which keeps its metadata
+        new = Hash_Map.__new__(Hash_Map)
+        new._index, new._entries, new._cnt = index, entries, cnt
+        if hasattr(self, '__meta__'): new.__meta__ = self.__meta__
+        return new
+
+    def assoc(self, key, val):
+        """Return a new map where key is bound to val."""
+        h = _hash(key)
+        i = _node_get(self._index, h, key, _missing)
+        if i is _missing:
+            entries = self._entries
+            index, _ = _node_assoc(self._index, 0, h, key, len(entries))
+            return self._derive(index, entries.conj((key, val)), self._cnt + 1)
+        entries = self._entries.assoc_n(i, (self._entries[i][0], val))
+        return self._derive(self._index, entries, self._cnt)
+
+    def dissoc(self, key):
+        """Return a new map without key."""
+        h = _hash(key)
+        i = _node_get(self._index, h, key, _missing)
+        if i is _missing:
+            return self._derive(self._index, self._entries, self._cnt)
+        index = _node_dissoc(self._index, 0, h, key) or _EMPTY_NODE
+        entries = self._entries.assoc_n(i, _missing)
+        new = self._derive(index, entries, self._cnt - 1)
+        if new._cnt * 2 < len(entries) and len(entries) > _WIDTH:
+            compact = Hash_Map(new.items())
+            new._index, new._entries = compact._index, compact._entries
+        return new
+
+    def get(self, key, default=None):
+        i = _node_get(self._index, _hash(key), key, _missing)
+        return default if i is _missing else self._entries[i][1]
+
+    def __getitem__(self, key):
+        i = _node_get(self._index, _hash(key), key, _missing)
+        if i is _missing: raise KeyError(key)
+        return self._entries[i][1]
+
+    def __contains__(self, key):
+        return _node_get(self._index, _hash(key), key, _missing) is not _missing
+
+    def __len__(self): return self._cnt
+    def __iter__(self): return self.keys()
+    def items(self): return (e for e in self._entries if e is not _missing)
+    def keys(self): return (e[0] for e in self._entries if e is not _missing)
+    def values(self): return (e[1] for e in self._entries if e is not _missing)
+
+    def __eq__(self, other):
+        if not isinstance(other, (dict, Hash_Map)): return NotImplemented
+        if type(other) is Hash_Map: return _equal_Q(self, other)
+        return len(self) == len(other) and all(
+            other.get(k, _missing) == v for k, v in self.items())
+
+    def __hash__(self):
+        try: return self._hash
+        except AttributeError: return _structural_hash(self)
+
+    def __copy__(self):
+        new = Hash_Map.__new__(Hash_Map)
+        new._index, new._entries, new._cnt = self._index, self._entries, self._cnt
+        return new
+
+    def __reduce__(self): return (Hash_Map, (list(self.items()),))
+    def __repr__(self): return repr(dict(self.items()))
 def _hash_map(*key_vals):
-    hm = Hash_Map()
-    for i in range(0,len(key_vals),2): hm[key_vals[i]] = key_vals[i+1]
-    return hm
+    return Hash_Map(zip(key_vals[0::2], key_vals[1::2]))
 def _hash_map_Q(exp): return type(exp) == Hash_Map
 
+# numeric vectors
+# A NumVector is an immutable vector of 64-bit signed integers stored
+# unboxed, in a numpy int64 array when numpy is importable and in an
+# array.array otherwise, so that elementwise arithmetic and reductions run
+# as bulk operations.  With numpy, results that overflow 64 bits wrap
+# around; array.array raises OverflowError instead.
+def _quot(a, b):
+    # Integer division truncating towards zero, like core's /
+    q = abs(a) // abs(b)
+    return -q if (a < 0) != (b < 0) else q
+
+def _np_quot(a, b):
+    q = numpy.abs(a) // numpy.abs(b)
+    return numpy.where((a < 0) != (b < 0), -q, q)
+
+def _has_zero(data):
+    if type(data) == int: return data == 0
+    if numpy is not None: return not data.all()
+    return 0 in data
+
+_num_ops = {'+': (operator.add, 'add'), '-': (operator.sub, 'subtract'),
+            '*': (operator.mul, 'multiply'), '/': (_quot, None)}
+
+class NumVector(object):
+    __slots__ = ('_data', '__meta__')
+
+    def __init__(self, vals=()):
+        vals = list(vals)
+        try:
+            if numpy is not None:
+                self._data = numpy.array(vals, dtype=numpy.int64)
+            else:
+                self._data = array.array('q', vals)
+        except (TypeError, ValueError):
+            raise MalException("numeric vector elements must be integers")
+
+    @classmethod
+    def _wrap(cls, data):
+        new = cls.__new__(cls)
+        new._data = data
+        return new
+
+    def __len__(self): return len(self._data)
+
+    def __iter__(self):
+        if numpy is not None: return iter(self._data.tolist())
+        return iter(self._data)
+
+    def __getitem__(self, i):
+        if type(i) == slice: return NumVector._wrap(self._data[i])
+        if i >= len(self._data): return None
+        return int(self._data[i])
+
+    def binop(self, name, other, reflected=False):
+        """Apply the arithmetic operator name (+ - * /) elementwise to this
+        vector and other, a NumVector of the same length or a number;
+        reflected puts other on the left."""
+        op, np_op = _num_ops[name]
+        if type(other) == NumVector:
+            if len(other) != len(self):
+                raise MalException("numeric vectors differ in length")
+            b = other._data
+        elif type(other) == int:
+            b = other
+        else:
+            raise MalException("expected a numeric vector or a number")
+        a = self._data
+        if reflected: a, b = b, a
+        if name == '/' and _has_zero(b):
+            raise MalException("division by zero")
+        if numpy is not None:
+            if np_op is None: return NumVector._wrap(_np_quot(a, b))
+            return NumVector._wrap(getattr(numpy, np_op)(a, b))
+        if type(a) == int: return NumVector._wrap(array.array('q', [op(a, y) for y in b]))
+        if type(b) == int: return NumVector._wrap(array.array('q', [op(x, b) for x in a]))
+        return NumVector._wrap(array.array('q', map(op, a, b)))
+
+    def sum(self):
+        if numpy is not None: return int(self._data.sum())
+        return sum(self._data)
+
+    def min(self):
+        if len(self._data) == 0: raise MalException("min of an empty numeric vector")
+        return int(self._data.min()) if numpy is not None else min(self._data)
+
+    def max(self):
+        if len(self._data) == 0: raise MalException("max of an empty numeric vector")
+        return int(self._data.max()) if numpy is not None else max(self._data)
+
+    def dot(self, other):
+        if len(other) != len(self):
+            raise MalException("numeric vectors differ in length")
+        if numpy is not None: return int(numpy.dot(self._data, other._data))
+        return sum(map(operator.mul, self._data, other._data))
+
+    def map(self, f):
+        """Return the NumVector of f applied to each element."""
+        return NumVector(map(f, self))
+
+    def __eq__(self, other):
+        if type(other) == NumVector:
+            if numpy is not None: return bool(numpy.array_equal(self._data, other._data))
+            return self._data == other._data
+        if not isinstance(other, (list, tuple, List, Vector, LazySeq)):
+            return NotImplemented
+        return _seq_eq(self, other)
+
+    def __hash__(self): return hash(tuple(self))
+
+    def __copy__(self): return NumVector._wrap(self._data)
+    def __reduce__(self): return (NumVector, (list(self),))
+    def __str__(self): return "#[" + " ".join(map(str, self)) + "]"
+    def __repr__(self): return str(self)
+def _num_vector(*vals): return NumVector(vals)
+def _num_vector_Q(exp): return type(exp) == NumVector
+
 # atoms
 class Atom(object):
+    __slots__ = ('val', '__meta__')
+
     def __init__(self, val):
         self.val = val
 def _atom(val): return Atom(val)
 def _atom_Q(exp):   return type(exp) == Atom
 
+# type tags for _equal_Q; types not listed are compared as _SCALAR
+_SCALAR, _STRING, _SYMBOL, _SEQ, _MAP = range(5)
+_eq_tags = {List: _SEQ, Vector: _SEQ, LazySeq: _SEQ, NumVector: _SEQ,
+            Hash_Map: _MAP, Symbol: _SYMBOL}
+for t in str_types: _eq_tags[t] = _STRING
+# the collections _structural_hash hashes, which keep their hash
+_hash_cached = frozenset((List, Vector, LazySeq, Hash_Map))
+
 def py_to_mal(obj):
         if type(obj) == list:   return List(obj)
         if type(obj) == tuple:  return List(obj)
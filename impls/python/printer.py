@@ -1,20 +1,12 @@
+import io
+from itertools import chain
 import mal_types as types
 
 def _escape(s):
     return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
-def _pr_str(obj, print_readably=True):
-    _r = print_readably
-    if types._list_Q(obj):
-        return "(" + " ".join(map(lambda e: _pr_str(e,_r), obj)) + ")"
-    elif types._vector_Q(obj):                                    
-        return "[" + " ".join(map(lambda e: _pr_str(e,_r), obj)) + "]"
-    elif types._hash_map_Q(obj):
-        ret = []
-        for k in obj.keys():
-            ret.extend((_pr_str(k), _pr_str(obj[k],_r)))
-        return "{" + " ".join(ret) + "}"
-    elif type(obj) in types.str_types:
+def _pr_scalar(obj, print_readably):
+    if type(obj) in types.str_types:
         if len(obj) > 0 and obj[0] == types._u('\u029e'):
             return ':' + obj[1:]
         elif print_readably:
@@ -27,8 +19,76 @@ def _pr_str(obj, print_readably=True):
         return "true"
     elif types._false_Q(obj):
         return "false"
-    elif types._atom_Q(obj):
-        return "(atom " + _pr_str(obj.val,_r) + ")"
     else:
         return obj.__str__()
 
+def _pr_write(obj, write, print_readably=True):
+    # Collections are printed from an explicit stack of open collections
+    # rather than by recursion, so neither deep nesting nor large
+    # collections cost more than one stack entry per open level.  A frame
+    # is [element iterator, closing text, first?, print_readably, key?];
+    # key? alternates for hash-maps, whose keys are always printed
+    # readably, and is None otherwise.  Chunks are handed to write in
+    # batches of about _BATCH, which bounds the memory used while keeping
+    # calls to write rare.
+    _r = print_readably
+    chunks = []
+    add = chunks.append
+    stack = []
+    while True:
+        if types._vector_Q(obj):
+            add("[")
+            stack.append([iter(obj), "]", True, _r, None])
+        elif types._sequential_Q(obj):
+            add("(")
+            stack.append([iter(obj), ")", True, _r, None])
+        elif types._hash_map_Q(obj):
+            add("{")
+            items = chain.from_iterable(obj.items())
+            stack.append([items, "}", True, _r, False])
+        elif types._atom_Q(obj):
+            add("(atom ")
+            stack.append([iter((obj.val,)), ")", True, _r, None])
+        else:
+            add(_pr_scalar(obj, _r))
+
+        if len(chunks) >= _BATCH:
+            write("".join(chunks))
+            del chunks[:]
+
+        # Move on to the next element of the innermost open collection
+        while stack:
+            frame = stack[-1]
+            obj = next(frame[0], _end)
+            if obj is _end:
+                add(frame[1])
+                stack.pop()
+                continue
+            if frame[2]: frame[2] = False
+            else:        add(" ")
+            _r = frame[3]
+            if frame[4] is not None:
+                frame[4] = not frame[4]
+                if frame[4]: _r = True
+            break
+        else:
+            break
+    write("".join(chunks))
+_BATCH = 1024
+_end = object()
+
+def pr_to(out, obj, print_readably=True):
+    """Write the printed form of obj to the file-like object out, in
+    chunks, without building the whole string first."""
+    if isinstance(out, (io.RawIOBase, io.BufferedIOBase)):
+        _pr_write(obj, lambda s: out.write(s.encode('utf-8')), print_readably)
+    else:
+        _pr_write(obj, out.write, print_readably)
+
+def _pr_str(obj, print_readably=True):
+    if not (types._sequential_Q(obj) or types._hash_map_Q(obj) or
+            types._atom_Q(obj)):
+        return _pr_scalar(obj, print_readably)
+    chunks = []
+    _pr_write(obj, chunks.append, print_readably)
+    return chunks[0] if len(chunks) == 1 else "".join(chunks)
@@ -1,8 +1,14 @@
-import re
-from mal_types import (_symbol, _keyword, _list, _vector, _hash_map, _s2u, _u)
+import io, os, re, mmap, pickle, hashlib
+from mal_types import (_symbol, _keyword, _list, _hash_map, _s2u, _u,
+                       List, Vector)
+try:
+    from mal_types import NumVector
+except ImportError: # implementations without numeric vectors
+    NumVector = None
 
 class Blank(Exception): pass
 
+# Reader over a list of tokens
 class Reader():
     def __init__(self, tokens, position=0):
         self.tokens = tokens
@@ -18,93 +24,255 @@ class Reader():
         else:
             return None
 
-def tokenize(str):
-    tre = re.compile(r"""[\s,]*(~@|[\[\]{}()'`~^@]|"(?:[\\].|[^\\"])*"?|;.*|[^\s\[\]{}()'"`@,;]+)""");
-    return [t for t in re.findall(tre, str) if t[0] != ';']
+# Reader over any iterator of tokens, holding just one token of lookahead
+class StreamReader():
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.token = next(self.tokens, None)
+
+    def next(self):
+        token = self.token
+        self.token = next(self.tokens, None)
+        return token
+
+    def peek(self):
+        return self.token
+
+# Every token kind is a named group, so a single match both splits the
+# input and classifies the token.  Comments are matched only to be skipped.
+_token_re = re.compile(r"""[\s,]*(?:
+      (?P<comment>;.*)
+    | (?P<macro>~@|['`~^@])
+    | (?P<open>\#\[|[\[({])
+    | (?P<close>[\])}])
+    | (?P<string>"(?:[\\].|[^\\"])*")
+    | (?P<unterminated>"(?:[\\].|[^\\"])*)
+    | (?P<number>-?[0-9][0-9.]*)(?![^\s\[\]{}()'"`@,;])
+    | (?P<keyword>:[^\s\[\]{}()'"`@,;]*)
+    | (?P<constant>nil|true|false)(?![^\s\[\]{}()'"`@,;])
+    | (?P<symbol>[^\s\[\]{}()'"`@,;]+))""", re.VERBOSE)
+
+# The same grammar over bytes, for scanning memory-mapped files
+_byte_token_re = re.compile(_token_re.pattern.encode('ascii'), re.VERBOSE)
+
+_constants = {'nil': None, 'true': True, 'false': False}
 
 def _unescape(s):
     return s.replace('\\\\', _u('\u029e')).replace('\\"', '"').replace('\\n', '\n').replace(_u('\u029e'), '\\')
 
+def _tokens(matches, decode=False):
+    for m in matches:
+        kind = m.lastgroup
+        text = m.group(kind)
+        if decode: text = text.decode('utf-8')
+        if kind == 'comment':    continue
+        elif kind == 'number':   yield (kind, int(text))
+        elif kind == 'string':   yield (kind, _s2u(_unescape(text[1:-1])))
+        elif kind == 'keyword':  yield (kind, _keyword(text[1:]))
+        elif kind == 'constant': yield (kind, _constants[text])
+        elif kind == 'symbol':   yield (kind, _symbol(text))
+        else:                    yield (kind, text)
+
+def tokenize(str):
+    """Return the (kind, value) tokens of str.  Atoms are converted to
+    their Mal values here; punctuation keeps its text as the value."""
+    return list(_tokens(_token_re.finditer(str)))
+
+def _stream_matches(file, size):
+    # A match that reaches the end of the buffer may still grow (a symbol,
+    # string or comment cut by the chunk boundary), and an unterminated
+    # string may just be waiting for its closing quote, so either is only
+    # taken once more input has arrived or the file is exhausted.
+    buf = ''
+    for chunk in iter(lambda: file.read(size), ''):
+        buf += chunk
+        pos = 0
+        for m in _token_re.finditer(buf):
+            if m.end() == len(buf) or m.lastgroup == 'unterminated': break
+            pos = m.end()
+            yield m
+        buf = buf[pos:]
+    for m in _token_re.finditer(buf):
+        yield m
+
+def tokenize_stream(file, size=65536):
+    """Like tokenize, but lazily reads the text from file in chunks."""
+    return _tokens(_stream_matches(file, size))
+
+def tokenize_mmap(data):
+    """Like tokenize_stream, but scans a memory-mapped (or any bytes-like)
+    buffer in place; only the text of each token is ever copied out."""
+    return _tokens(_byte_token_re.finditer(data), decode=True)
+
 def read_atom(reader):
-    int_re = re.compile(r"-?[0-9]+$")
-    float_re = re.compile(r"-?[0-9][0-9.]*$")
-    string_re = re.compile(r'"(?:[\\].|[^\\"])*"')
-    token = reader.next()
-    if re.match(int_re, token):     return int(token)
-    elif re.match(float_re, token): return int(token)
-    elif re.match(string_re, token):return _s2u(_unescape(token[1:-1]))
-    elif token[0] == '"':           raise Exception("expected '\"', got EOF")
-    elif token[0] == ':':           return _keyword(token[1:])
-    elif token == "nil":            return None
-    elif token == "true":           return True
-    elif token == "false":          return False
-    else:                           return _symbol(token)
+    kind, value = reader.next()
+    if kind == 'unterminated': raise Exception("expected '\"', got EOF")
+    return value
 
 def read_sequence(reader, typ=list, start='(', end=')'):
-    ast = typ()
+    ast = []
     token = reader.next()
-    if token != start: raise Exception("expected '" + start + "'")
+    if token[1] != start: raise Exception("expected '" + start + "'")
 
     token = reader.peek()
-    while token != end:
+    while token != ('close', end):
         if not token: raise Exception("expected '" + end + "', got EOF")
         ast.append(read_form(reader))
         token = reader.peek()
     reader.next()
-    return ast
+    return typ(ast)
 
 def read_hash_map(reader):
     lst = read_sequence(reader, list, '{', '}')
     return _hash_map(*lst)
 
 def read_list(reader):
-    return read_sequence(reader, _list, '(', ')')
+    return read_sequence(reader, List, '(', ')')
 
 def read_vector(reader):
-    return read_sequence(reader, _vector, '[', ']')
+    return read_sequence(reader, Vector, '[', ']')
+
+def read_num_vector(reader):
+    if NumVector is None: raise Exception("numeric vectors are not supported")
+    return read_sequence(reader, NumVector, '#[', ']')
+
+_macros = {"'": 'quote', '`': 'quasiquote', '~': 'unquote',
+           '~@': 'splice-unquote', '@': 'deref'}
+
+_collections = {'(': read_list, '[': read_vector, '{': read_hash_map,
+                '#[': read_num_vector}
 
 def read_form(reader):
     token = reader.peek()
+    if not token: raise Exception("unexpected EOF")
+    kind, value = token
     # reader macros/transforms
-    if token[0] == ';':
-        reader.next()
-        return None
-    elif token == '\'':
-        reader.next()
-        return _list(_symbol('quote'), read_form(reader))
-    elif token == '`':
-        reader.next()
-        return _list(_symbol('quasiquote'), read_form(reader))
-    elif token == '~':
-        reader.next()
-        return _list(_symbol('unquote'), read_form(reader))
-    elif token == '~@':
-        reader.next()
-        return _list(_symbol('splice-unquote'), read_form(reader))
-    elif token == '^':
+    if kind == 'macro':
         reader.next()
-        meta = read_form(reader)
-        return _list(_symbol('with-meta'), read_form(reader), meta)
-    elif token == '@':
-        reader.next()
-        return _list(_symbol('deref'), read_form(reader))
-
-    # list
-    elif token == ')': raise Exception("unexpected ')'")
-    elif token == '(': return read_list(reader)
-
-    # vector
-    elif token == ']': raise Exception("unexpected ']'");
-    elif token == '[': return read_vector(reader);
+        if value == '^':
+            meta = read_form(reader)
+            return _list(_symbol('with-meta'), read_form(reader), meta)
+        return _list(_symbol(_macros[value]), read_form(reader))
 
-    # hash-map
-    elif token == '}': raise Exception("unexpected '}'");
-    elif token == '{': return read_hash_map(reader);
+    # list, vector, hash-map
+    elif kind == 'close': raise Exception("unexpected '" + value + "'")
+    elif kind == 'open':  return _collections[value](reader)
 
     # atom
-    else:              return read_atom(reader);
+    else:                 return read_atom(reader)
 
 def read_str(str):
     tokens = tokenize(str)
     if len(tokens) == 0: raise Blank("Blank Line")
     return read_form(Reader(tokens))
+
+def read_forms(file):
+    """Yield the top-level forms of file one at a time, reading only as
+    much of it as the next form needs."""
+    reader = StreamReader(tokenize_stream(file))
+    while reader.peek():
+        yield read_form(reader)
+
+def read_file_data(path):
+    """Read the first form of the file at path without loading the file
+    into a string: the file is memory-mapped and tokenized in place, and
+    values are built only as the reader reaches them."""
+    with open(path, 'rb') as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty files cannot be mapped
+            raise Blank("Blank Line")
+        tokens = tokenize_mmap(data)
+        try:
+            reader = StreamReader(tokens)
+            if not reader.peek(): raise Blank("Blank Line")
+            return read_form(reader)
+        finally:
+            # the scanner must let go of the buffer before it can be unmapped
+            tokens.close()
+            data.close()
+
+# On-disk cache of the forms read from files.  Entries are per file and
+# per implementation directory, and are only used while the file's
+# modification time and content hash are those recorded in the entry.
+# The cache is off unless MAL_AST_CACHE names a directory for it.  As
+# entries are unpickled, the directory is made private to the user, and
+# neither it nor an entry is used unless the user owns it and no one else
+# can write to it.
+ast_cache_dir = os.environ.get('MAL_AST_CACHE', '')
+ast_cache_stats = {'hits': 0, 'misses': 0}
+_AST_CACHE_VERSION = 7
+
+def _private(st):
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+def _ast_cache_path(path):
+    impl = os.path.dirname(os.path.abspath(__file__))
+    key = hashlib.sha256((impl + '\0' + path).encode('utf-8')).hexdigest()
+    return os.path.join(ast_cache_dir, key)
+
+def _ast_cache_ready():
+    try:
+        os.makedirs(ast_cache_dir, mode=0o700, exist_ok=True)
+        return _private(os.stat(ast_cache_dir))
+    except OSError:
+        return False
+
+def _read_cached_forms(path, header):
+    try:
+        file = open(_ast_cache_path(path), 'rb')
+    except OSError:
+        return None
+    try:
+        if _private(os.fstat(file.fileno())) and pickle.load(file) == header:
+            return file
+    except Exception:
+        pass
+    file.close()
+    return None
+
+def read_file_forms(path):
+    """Yield the top-level forms of the file at path, like read_forms,
+    but from the AST cache when it holds an up to date entry.  On a miss
+    the forms are written to a new entry as they are read."""
+    path = os.path.abspath(path)
+    if not ast_cache_dir or not _ast_cache_ready():
+        with open(path) as file:
+            for form in read_forms(file): yield form
+        return
+
+    # The file is read once, for its hash and, on a miss, its forms
+    with open(path, 'rb') as file:
+        mtime, data = os.fstat(file.fileno()).st_mtime_ns, file.read()
+    header = (_AST_CACHE_VERSION, path, mtime, hashlib.sha256(data).hexdigest())
+    cached = _read_cached_forms(path, header)
+    if cached:
+        ast_cache_stats['hits'] += 1
+        with cached:
+            while True:
+                try:
+                    form = pickle.load(cached)
+                except EOFError:
+                    return
+                yield form
+
+    ast_cache_stats['misses'] += 1
+    forms = read_forms(io.StringIO(data.decode('utf-8')))
+    entry = _ast_cache_path(path)
+    tmp = entry + '.' + str(os.getpid())
+    try:
+        out = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb')
+    except OSError:
+        for form in forms: yield form
+        return
+    # Only a file that was read through to the end gets an entry
+    try:
+        pickle.dump(header, out, pickle.HIGHEST_PROTOCOL)
+        for form in forms:
+            pickle.dump(form, out, pickle.HIGHEST_PROTOCOL)
+            yield form
+        out.close()
+        os.replace(tmp, entry)
+    finally:
+        out.close()
+        if os.path.exists(tmp): os.remove(tmp)
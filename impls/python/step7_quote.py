@@ -4,7 +4,7 @@ import mal_readline
 import mal_types as types
 import reader, printer
 from env import Env
-import core
+import core, arith
 
 # read
 def READ(str):
@@ -93,10 +93,13 @@ def EVAL(ast, env):
         else:
             el = eval_ast(ast, env)
             f = el[0]
-            if hasattr(f, '__ast__'):
-                ast = f.__ast__
-                env = f.__gen_env__(el[1:])
+            if type(f) == types.MalFunction:
+                ast = f.ast
+                env = Env(f.env, f.params, el[1:])
             else:
+                if len(el) == 3:
+                    op = arith.binary.get(id(f))
+                    if op: return op(el[1], el[2])
                 return f(*el[1:])
 
 # print
@@ -4,7 +4,7 @@ import mal_readline
 import mal_types as types
 import reader, printer
 from env import Env
-import core
+import core, arith
 
 # read
 def READ(str):
@@ -37,7 +37,7 @@ def is_macro_call(ast, env):
     return (types._list_Q(ast) and
             types._symbol_Q(ast[0]) and
             env.find(ast[0]) and
-            hasattr(env.get(ast[0]), '_ismacro_'))
+            types._macro_Q(env.get(ast[0])))
 
 def macroexpand(ast, env):
     while is_macro_call(ast, env):
@@ -91,7 +91,7 @@ def EVAL(ast, env):
             # Continue loop (TCO)
         elif 'defmacro!' == a0:
             func = types._clone(EVAL(ast[2], env))
-            func._ismacro_ = True
+            func.is_macro = True
             return env.set(ast[1], func)
         elif 'macroexpand' == a0:
             return macroexpand(ast[1], env)
@@ -114,10 +114,13 @@ def EVAL(ast, env):
         else:
             el = eval_ast(ast, env)
             f = el[0]
-            if hasattr(f, '__ast__'):
-                ast = f.__ast__
-                env = f.__gen_env__(el[1:])
+            if type(f) == types.MalFunction:
+                ast = f.ast
+                env = Env(f.env, f.params, el[1:])
             else:
+                if len(el) == 3:
+                    op = arith.binary.get(id(f))
+                    if op: return op(el[1], el[2])
                 return f(*el[1:])
 
 # print
@@ -1,10 +1,9 @@
 import functools
-import sys, traceback
-import mal_readline
+import os, sys, traceback
 import mal_types as types
 import reader, printer
-from env import Env
-import core
+from env import Env, Scope, Frame, unbound
+import core, arith
 
 # read
 def READ(str):
@@ -33,11 +32,47 @@ def quasiquote(ast):
     else:
         return ast
 
+# quasiquote builds the canonical expansion that quasiquoteexpand shows,
+# which conses every element of a template on each evaluation.  qq_lifted
+# is the one evaluated: parts of the template holding no unquote become
+# quoted literals, shared by every evaluation, and so does the constant
+# tail of a list.
+def qq_splice(elt):
+    return types._list_Q(elt) and len(elt) == 2 and elt[0] == u'splice-unquote'
+
+def qq_constant(ast):
+    if types._list_Q(ast) and len(ast) == 2 and ast[0] == u'unquote':
+        return False
+    if types._list_Q(ast) or types._vector_Q(ast):
+        return not any(qq_splice(elt) or not qq_constant(elt) for elt in ast)
+    return True
+
+def qq_lifted(ast):
+    if qq_constant(ast):
+        if (types._list_Q(ast) or types._vector_Q(ast) or
+                types._hash_map_Q(ast) or types._symbol_Q(ast)):
+            return types._list(types._symbol(u'quote'), ast)
+        return ast
+    if types._list_Q(ast) and len(ast) == 2 and ast[0] == u'unquote':
+        return ast[1]
+    i = len(ast)
+    while i > 0 and not qq_splice(ast[i-1]) and qq_constant(ast[i-1]):
+        i -= 1
+    if i < len(ast): acc = types._list(types._symbol(u'quote'), types._list(*ast[i:]))
+    else:            acc = types._list()
+    for elt in reversed(ast[:i]):
+        if qq_splice(elt):
+            acc = types._list(types._symbol(u'concat'), elt[1], acc)
+        else:
+            acc = types._list(types._symbol(u'cons'), qq_lifted(elt), acc)
+    if types._vector_Q(ast): return types._list(types._symbol(u'vec'), acc)
+    return acc
+
 def is_macro_call(ast, env):
     return (types._list_Q(ast) and
             types._symbol_Q(ast[0]) and
             env.find(ast[0]) and
-            hasattr(env.get(ast[0]), '_ismacro_'))
+            types._macro_Q(env.get(ast[0])))
 
 def macroexpand(ast, env):
     while is_macro_call(ast, env):
@@ -45,105 +80,1028 @@ def macroexpand(ast, env):
         ast = mac(*ast[1:])
     return ast
 
-def eval_ast(ast, env):
+# resolve
+# Each form is resolved into a tree of the nodes below before it is
+# evaluated.  Macro calls are expanded and quasiquotes rewritten on the
+# way, and a symbol bound by an enclosing fn*, let* or catch* becomes a
+# Local holding the (depth, slot) address of its binding in the frames
+# built at run time.  Other symbols are Globals, looked up in repl_env.
+# def! inside a fn*, let* or catch* body gets a slot in the innermost
+# frame, which reads as unbound, and so falls back to the outer binding,
+# until the def! has run.  The def! forms of a body, and of the do forms
+# in it, get their slots before anything in the body is resolved, so that
+# closures defined before them can refer to them.  A Local is bound when its slot is known to be
+# set whenever the Local is evaluated: parameters and the catch* symbol.
+#
+# A call of a global macro becomes a MacroCall, which keeps the form and
+# is expanded when it first runs, or straight away when MAL_EXPAND is
+# "eager", that is when the enclosing fn* is defined.  Either way the
+# expansion is resolved and analyzed once, and used again for as long as
+# the name is bound to the same macro.  A symbol resolved after a MacroCall
+# left for later, in its scope or one inside it, and bound by none of them
+# yet, is Dynamic, as the expansion may def! it.  It is looked up like a
+# Global until one of those scopes has the name, and through the frames
+# from then on: an expansion that adds names to its scope changes the
+# version of repl_env, so that no cached global value outlives it.
+
+class Node(object):
+    __slots__ = ()
+    def __init__(self, *args):
+        for name, value in zip(self.__slots__, args): setattr(self, name, value)
+
+class Const(Node):       __slots__ = ('value',)
+class Local(Node):       __slots__ = ('depth', 'slot', 'name', 'bound')
+class Global(Node):      __slots__ = ('name', 'version', 'value')
+class Dynamic(Node):     __slots__ = ('name', 'scopes', 'version', 'value')
+class VectorNode(Node):  __slots__ = ('items',)
+class HashMapNode(Node): __slots__ = ('keys', 'vals')
+class Def(Node):         __slots__ = ('name', 'value', 'macro')
+class Let(Node):         __slots__ = ('scope', 'inits', 'body')
+class Do(Node):          __slots__ = ('forms', 'last')
+class If(Node):          __slots__ = ('test', 'then', 'else_')
+class Fn(Node):          __slots__ = ('params', 'scope', 'body', 'arity', 'bind')
+class Try(Node):         __slots__ = ('body', 'scope', 'handler')
+class Call(Node):        __slots__ = ('fn', 'args', 'form', 'scope')
+class MacroCall(Node):   __slots__ = ('form', 'scope', 'macro', 'expansion')
+class MacroExpand(Node): __slots__ = ('form',)
+class PyExec(Node):      __slots__ = ('code',)
+class PyEval(Node):      __slots__ = ('code',)
+class Interop(Node):     __slots__ = ('name', 'args')
+
+eager_macros = os.environ.get('MAL_EXPAND') == 'eager'
+
+def global_macro(ast, scope):
+    """The macro ast calls, if its head is a symbol bound to a macro in
+    repl_env and not shadowed by a local binding."""
+    if not (types._list_Q(ast) and types._symbol_Q(ast[0])): return None
+    if scope and scope.lookup(ast[0]): return None
+    mac = repl_env.data.get(ast[0])
+    return mac if types._macro_Q(mac) else None
+
+def lazy_scopes(scope):
+    scopes = []
+    while scope is not None:
+        if scope.lazy: scopes.append(scope)
+        scope = scope.outer
+    return tuple(scopes)
+
+def local_name(name, scopes):
+    """Whether a Dynamic for name is to be looked up through the frames."""
+    for scope in scopes:
+        if name in scope.index: return True
+    return False
+
+def declare_defs(ast, scope):
+    """Give the names def! binds in the body ast their slots in scope."""
+    if not (types._list_Q(ast) and len(ast) > 1): return
+    if ast[0] == 'do':
+        for form in ast[1:]: declare_defs(form, scope)
+    elif ast[0] in ('def!', 'defmacro!') and types._symbol_Q(ast[1]):
+        scope.add(ast[1])
+
+def resolve_def(ast, scope):
+    # The slot comes first, so that the value can refer to the name, as a
+    # recursive fn* does, if declare_defs has not given it already
+    if scope: scope.add(ast[1])
+    return Def(ast[1], resolve(ast[2], scope), False)
+
+def resolve_defmacro(ast, scope):
+    node = resolve_def(ast, scope)
+    node.macro = True
+    return node
+
+def resolve_let(ast, scope):
+    # Every name gets its slot first, as a binding can be referred to by
+    # the closures of those before it
+    bindings = ast[1]
+    let_scope = Scope(bindings[0::2], scope)
+    let_scope.bound = 0
+    declare_defs(ast[2], let_scope)
+    inits = tuple((let_scope.index[bindings[i]], resolve(bindings[i+1], let_scope))
+                  for i in range(0, len(bindings), 2))
+    return Let(let_scope, inits, resolve(ast[2], let_scope))
+
+def resolve_do(ast, scope):
+    if len(ast) < 2: return Const(None)
+    forms = tuple(resolve(a, scope) for a in ast[1:])
+    return Do(forms[:-1], forms[-1])
+
+def resolve_if(ast, scope):
+    else_ = resolve(ast[3], scope) if len(ast) > 3 else Const(None)
+    return If(resolve(ast[1], scope), resolve(ast[2], scope), else_)
+
+def resolve_fn(ast, scope):
+    # The binding plan: the parameters take the first slots in order, a
+    # rest parameter the one after the arity fixed ones
+    params = ast[1]
+    fn_scope = Scope([p for p in params if p != '&'], scope)
+    if '&' in params:
+        arity, binder = list(params).index('&'), bind_rest
+    else:
+        arity, binder = len(params), bind_fixed
+    declare_defs(ast[2], fn_scope)
+    return Fn(params, fn_scope, resolve(ast[2], fn_scope), arity, binder)
+
+def resolve_try(ast, scope):
+    if len(ast) < 3 or ast[2][0] != "catch*":
+        return Try(resolve(ast[1], scope), None, None)
+    catch_scope = Scope([ast[2][1]], scope)
+    declare_defs(ast[2][2], catch_scope)
+    return Try(resolve(ast[1], scope), catch_scope,
+               resolve(ast[2][2], catch_scope))
+
+special_forms = {
+    'def!':             resolve_def,
+    'defmacro!':        resolve_defmacro,
+    'let*':             resolve_let,
+    'do':               resolve_do,
+    'if':               resolve_if,
+    'fn*':              resolve_fn,
+    'try*':             resolve_try,
+    'quote':            lambda ast, scope: Const(ast[1]),
+    'quasiquoteexpand': lambda ast, scope: Const(quasiquote(ast[1])),
+    'quasiquote':       lambda ast, scope: resolve(qq_lifted(ast[1]), scope),
+    'macroexpand':      lambda ast, scope: MacroExpand(ast[1]),
+    'py!*':             lambda ast, scope: PyExec(ast[1]),
+    'py*':              lambda ast, scope: PyEval(ast[1]),
+    '.':                lambda ast, scope: Interop(
+                            ast[1], tuple(resolve(a, scope) for a in ast[2:])),
+}
+
+def resolve(ast, scope):
     if types._symbol_Q(ast):
-        return env.get(ast)
+        addr = scope.lookup(ast) if scope else None
+        if addr: return Local(addr[0], addr[1], ast, addr[2])
+        scopes = lazy_scopes(scope)
+        if scopes: return Dynamic(ast, scopes, -1, None)
+        return Global(ast, -1, None)
     elif types._list_Q(ast):
-        return types._list(*map(lambda a: EVAL(a, env), ast))
+        mac = global_macro(ast, scope)
+        if mac:
+            if not eager_macros:
+                if scope: scope.lazy = True
+                return MacroCall(ast, scope, None, None)
+            return MacroCall(ast, scope, mac, expand(mac, ast, scope))
+        if len(ast) == 0: return Const(ast)
+        a0 = ast[0]
+        if types._symbol_Q(a0) and a0 in special_forms:
+            return special_forms[a0](ast, scope)
+        return Call(resolve(a0, scope), tuple(resolve(a, scope) for a in ast[1:]),
+                    ast, scope)
     elif types._vector_Q(ast):
-        return types._vector(*map(lambda a: EVAL(a, env), ast))
+        items = tuple(resolve(a, scope) for a in ast)
+        if all(type(n) is Const for n in items):
+            return Const(types._vector(*[n.value for n in items]))
+        return VectorNode(items)
     elif types._hash_map_Q(ast):
-        return types.Hash_Map((k, EVAL(v, env)) for k, v in ast.items())
+        vals = tuple(resolve(v, scope) for v in ast.values())
+        if all(type(n) is Const for n in vals):
+            return Const(types.Hash_Map(zip(ast.keys(), [n.value for n in vals])))
+        return HashMapNode(tuple(ast.keys()), vals)
     else:
-        return ast  # primitive value, return unchanged
+        return Const(ast)  # primitive value
 
-def EVAL(ast, env):
-    while True:
-        #print("EVAL %s" % printer._pr_str(ast))
-        if not types._list_Q(ast):
-            return eval_ast(ast, env)
-
-        # apply list
-        ast = macroexpand(ast, env)
-        if not types._list_Q(ast):
-            return eval_ast(ast, env)
-        if len(ast) == 0: return ast
-        a0 = ast[0]
+def expand(mac, form, scope):
+    """The resolved expansion of form, a call of the macro mac."""
+    stats['macro-expansions'] += 1
+    n = len(scope.names) if scope else 0
+    node = resolve(mac(*form[1:]), scope)
+    if scope and len(scope.names) > n: repl_env.version += 1
+    return node
 
-        if "def!" == a0:
-            a1, a2 = ast[1], ast[2]
-            res = EVAL(a2, env)
-            return env.set(a1, res)
-        elif "let*" == a0:
-            a1, a2 = ast[1], ast[2]
-            let_env = Env(env)
-            for i in range(0, len(a1), 2):
-                let_env.set(a1[i], EVAL(a1[i+1], let_env))
-            ast = a2
-            env = let_env
-            # Continue loop (TCO)
-        elif "quote" == a0:
-            return ast[1]
-        elif "quasiquoteexpand" == a0:
-            return quasiquote(ast[1]);
-        elif "quasiquote" == a0:
-            ast = quasiquote(ast[1]);
-            # Continue loop (TCO)
-        elif 'defmacro!' == a0:
-            func = types._clone(EVAL(ast[2], env))
-            func._ismacro_ = True
-            return env.set(ast[1], func)
-        elif 'macroexpand' == a0:
-            return macroexpand(ast[1], env)
-        elif "py!*" == a0:
-            exec(compile(ast[1], '', 'single'), globals())
-            return None
-        elif "py*" == a0:
-            return types.py_to_mal(eval(ast[1]))
-        elif "." == a0:
-            el = eval_ast(ast[2:], env)
-            f = eval(ast[1])
-            return f(*el)
-        elif "try*" == a0:
-            if len(ast) < 3:
-                return EVAL(ast[1], env)
-            a1, a2 = ast[1], ast[2]
-            if a2[0] == "catch*":
-                err = None
-                try:
-                    return EVAL(a1, env)
-                except types.MalException as exc:
-                    err = exc.object
-                except Exception as exc:
-                    err = exc.args[0]
-                catch_env = Env(env, [a2[1]], [err])
-                return EVAL(a2[2], catch_env)
-            else:
-                return EVAL(a1, env);
-        elif "do" == a0:
-            eval_ast(ast[1:-1], env)
-            ast = ast[-1]
-            # Continue loop (TCO)
-        elif "if" == a0:
-            a1, a2 = ast[1], ast[2]
-            cond = EVAL(a1, env)
-            if cond is None or cond is False:
-                if len(ast) > 3: ast = ast[3]
-                else:            ast = None
-            else:
-                ast = a2
-            # Continue loop (TCO)
-        elif "fn*" == a0:
-            a1, a2 = ast[1], ast[2]
-            return types._function(EVAL, Env, a2, env, a1)
+# analyze
+# Each resolved node is analyzed once into a Python closure that takes the
+# frame it runs in, or repl_env at top level.  All the dispatch on the kind
+# of node happens here, not each time the node runs, and the closure for a
+# fn* body is made once, when the fn* is analyzed, and shared by all the
+# MalFunctions it makes.
+#
+# Tail position closures return a TailCall instead of calling a
+# MalFunction, and whoever called them keeps calling until it gets a value,
+# so loops by tail recursion take constant Python stack.
+#
+# A Global caches the value it found with the version of repl_env it was
+# found in, and only looks again once a def! has changed repl_env: local
+# bindings that could shadow it are all known when it is resolved.  A Call
+# whose head is a Global keeps the same cache itself, together with the
+# two-argument arith entry for the value.  A Call whose head only turns
+# out to be a macro at run time, because the macro was defined after the
+# call was resolved, expands, resolves and analyzes the call then, and
+# keeps the result for as long as the head is the same macro.
+
+# Counts of global lookups answered from a cache and made again, and of
+# macro calls run from a kept expansion and expanded, returned by
+# (eval-stats) and printed on exit when MAL_STATS is set
+stats = {'global-hits': 0, 'global-misses': 0,
+         'macro-hits': 0, 'macro-expansions': 0}
+
+def eval_stats():
+    return types.Hash_Map((types._keyword(k), v) for k, v in stats.items())
+
+class TailCall(object):
+    __slots__ = ('body', 'env')
+    def __init__(self, body, env): self.body, self.env = body, env
+
+def run(body, env):
+    res = body(env)
+    while type(res) is TailCall:
+        res = res.body(res.env)
+    return res
+
+# Frames for a call of a closure made from the Fn node fn.  args is either
+# the list of argument values the evaluator has just built, which becomes
+# the frame's values as it is, or the tuple a call from Python passes.
+# Slots for def! in the body are added by the def!.
+def arity_error(fn, n, at_least=''):
+    raise types.MalException("fn*: wrong number of arguments (%d, expected %s%d)"
+                             % (n, at_least, fn.arity))
+
+def bind_fixed(outer, fn, args):
+    if len(args) != fn.arity: arity_error(fn, len(args))
+    return Frame(outer, fn.scope, args if type(args) is list else list(args))
+
+def bind_rest(outer, fn, args):
+    n = fn.arity
+    if len(args) < n: arity_error(fn, len(args), 'at least ')
+    vals = list(args[:n])
+    vals.append(types.List(tuple(args[n:])))
+    return Frame(outer, fn.scope, vals)
+
+def analyze_const(node, tail):
+    value = node.value
+    return lambda env: value
+
+def analyze_local(node, tail):
+    depth, slot, name = node.depth, node.slot, node.name
+    if node.bound and depth == 0: return lambda env: env.vals[slot]
+    if node.bound and depth == 1: return lambda env: env.outer.vals[slot]
+    if depth == 0:
+        def local0(env):
+            try:
+                val = env.vals[slot]
+            except IndexError:
+                val = unbound
+            if val is unbound: return env.outer.get(name)
+            return val
+        return local0
+    def local(env):
+        for _ in range(depth): env = env.outer
+        try:
+            val = env.vals[slot]
+        except IndexError:
+            val = unbound
+        if val is unbound: return env.outer.get(name)
+        return val
+    return local
+
+def lookup_global(name):
+    try:
+        return repl_env.data[name]
+    except KeyError:
+        raise Exception("'" + name + "' not found") from None
+
+def analyze_global(node, tail):
+    name, version, value = node.name, -1, None
+    def global_(env):
+        nonlocal version, value
+        if version == repl_env.version:
+            stats['global-hits'] += 1
+            return value
+        stats['global-misses'] += 1
+        value, version = lookup_global(name), repl_env.version
+        return value
+    return global_
+
+def analyze_dynamic(node, tail):
+    name, scopes, version, value = node.name, node.scopes, -1, None
+    def dynamic(env):
+        nonlocal version, value
+        if version == repl_env.version:
+            stats['global-hits'] += 1
+            return value
+        if local_name(name, scopes): return env.get(name)
+        stats['global-misses'] += 1
+        value, version = lookup_global(name), repl_env.version
+        return value
+    return dynamic
+
+def analyze_call(node, tail):
+    fn = analyze(node.fn)
+    args = tuple(analyze(a) for a in node.args)
+    n = len(args)
+    a0, a1 = (args + (None, None))[:2]
+    cache = type(node.fn) is Global or type(node.fn) is Dynamic
+    scopes = node.fn.scopes if type(node.fn) is Dynamic else ()
+    version, value, op = -1, None, None
+    expansion = None  # (macro, closure) for a head found to be a macro
+    def call(env):
+        nonlocal version, value, op, expansion
+        if version == repl_env.version:
+            stats['global-hits'] += 1
+            f = value
+        else:
+            f = fn(env)
+            op = arith.binary.get(id(f)) if n == 2 else None
+            if cache and not local_name(node.fn.name, scopes):
+                version, value = repl_env.version, f
+        if type(f) is types.MalFunction:
+            if f.is_macro:
+                if expansion is None or expansion[0] is not f:
+                    expansion = (f, analyze(expand(f, node.form, node.scope), tail))
+                else:
+                    stats['macro-hits'] += 1
+                return expansion[1](env)
+            if n == 2:   argv = [a0(env), a1(env)]
+            elif n == 1: argv = [a0(env)]
+            else:        argv = [a(env) for a in args]
+            env = f._Env(f.env, f.params, argv)
+            if tail: return TailCall(f.ast, env)
+            res = f.ast(env)
+            while type(res) is TailCall:
+                res = res.body(res.env)
+            return res
+        if op: return op(a0(env), a1(env))
+        return f(*[a(env) for a in args])
+    return call
+
+def analyze_macro_call(node, tail):
+    form, scope, name, mac = node.form, node.scope, node.form[0], node.macro
+    if node.expansion is None: body, version = None, -1
+    else:                      body, version = analyze(node.expansion, tail), repl_env.version
+    expanded = body is not None
+    def macro_call(env):
+        nonlocal body, version, mac, expanded
+        if version != repl_env.version:
+            version = repl_env.version
+            current = repl_env.data.get(name)
+            if body is None or current is not mac:
+                # Not expanded yet, or the name was bound again since
+                mac, expanded = current, types._macro_Q(current)
+                if expanded: node = expand(current, form, scope)
+                else:        node = resolve(form, scope)
+                body = analyze(node, tail)
+                return body(env)
+        if expanded: stats['macro-hits'] += 1
+        return body(env)
+    return macro_call
+
+def analyze_if(node, tail):
+    test, then, else_ = analyze(node.test), analyze(node.then, tail), analyze(node.else_, tail)
+    def if_(env):
+        cond = test(env)
+        if cond is None or cond is False: return else_(env)
+        return then(env)
+    return if_
+
+def analyze_do(node, tail):
+    forms, last = tuple(analyze(f) for f in node.forms), analyze(node.last, tail)
+    def do(env):
+        for form in forms: form(env)
+        return last(env)
+    return do
+
+def analyze_let(node, tail):
+    scope, n = node.scope, len(node.scope.names)
+    inits = tuple((slot, analyze(init)) for slot, init in node.inits)
+    body = analyze(node.body, tail)
+    def let(env):
+        vals = [unbound] * n
+        env = Frame(env, scope, vals)
+        for slot, init in inits:
+            vals[slot] = init(env)
+        return body(env)
+    return let
+
+def analyze_fn(node, tail):
+    body, binder = analyze(node.body, True), node.bind
+    return lambda env: types._function(run, binder, body, env, node)
+
+def analyze_def(node, tail):
+    name, value, macro = node.name, analyze(node.value), node.macro
+    def def_(env):
+        val = value(env)
+        if macro:
+            val = types._clone(val)
+            val.is_macro = True
+        return env.set(name, val)
+    return def_
+
+def analyze_try(node, tail):
+    body = analyze(node.body)
+    if node.handler is None: return body
+    scope, handler = node.scope, analyze(node.handler, tail)
+    def try_(env):
+        try:
+            return body(env)
+        except types.MalException as exc:
+            err = exc.object
+        except Exception as exc:
+            err = exc.args[0]
+        return handler(Frame(env, scope, [err]))
+    return try_
+
+def analyze_vector(node, tail):
+    items = tuple(analyze(a) for a in node.items)
+    return lambda env: types._vector(*[item(env) for item in items])
+
+def analyze_hash_map(node, tail):
+    keys, vals = node.keys, tuple(analyze(v) for v in node.vals)
+    return lambda env: types.Hash_Map(zip(keys, [val(env) for val in vals]))
+
+def analyze_macroexpand(node, tail):
+    form = node.form
+    return lambda env: macroexpand(form, env)
+
+def analyze_py_exec(node, tail):
+    code = compile(node.code, '', 'single')
+    def py_exec(env):
+        exec(code, globals())
+        return None
+    return py_exec
+
+def analyze_py_eval(node, tail):
+    code = node.code
+    return lambda env: types.py_to_mal(eval(code))
+
+def analyze_interop(node, tail):
+    name, args = node.name, tuple(analyze(a) for a in node.args)
+    return lambda env: eval(name)(*[a(env) for a in args])
+
+analyzers = {
+    Const:       analyze_const,
+    Local:       analyze_local,
+    Global:      analyze_global,
+    Dynamic:     analyze_dynamic,
+    Call:        analyze_call,
+    MacroCall:   analyze_macro_call,
+    If:          analyze_if,
+    Do:          analyze_do,
+    Let:         analyze_let,
+    Fn:          analyze_fn,
+    Def:         analyze_def,
+    Try:         analyze_try,
+    VectorNode:  analyze_vector,
+    HashMapNode: analyze_hash_map,
+    MacroExpand: analyze_macroexpand,
+    PyExec:      analyze_py_exec,
+    PyEval:      analyze_py_eval,
+    Interop:     analyze_interop,
+}
+
+def analyze(node, tail=False):
+    return analyzers[type(node)](node, tail)
+
+# explicit stack
+# When MAL_EVAL is "stack", resolved nodes are run by run_node instead of
+# being analyzed into closures.  run_node keeps what is left to do once the
+# node in hand has a value as a list of continuation frames, so a non-tail
+# call takes a list entry rather than Python stack, and recursion goes as
+# deep as memory allows.  A call in tail position, the branch of an if and
+# the body of a let* push nothing.  A call made with more than MAL_MAX_DEPTH
+# frames pending raises a MalException, which try* can catch.
+#
+# An exception drops the frames down to the innermost try* with a catch*.
+# A MalFunction called from Python, by map, apply or swap!, runs in a
+# run_node of its own.  A Global keeps the value it found on the node,
+# with the version of repl_env, as analyze_global keeps it in its closure.
+
+stack_eval = os.environ.get('MAL_EVAL') == 'stack'
+max_depth = int(os.environ.get('MAL_MAX_DEPTH', 1000000))
+
+# Each continuation frame is a list of one of these, the node that pushed
+# it and the env it runs in, followed by the state of the node
+K_CALL, K_IF, K_DO, K_LET, K_DEF, K_TRY, K_ITEMS = range(7)
+
+def lookup_local(node, env):
+    for _ in range(node.depth): env = env.outer
+    try:
+        val = env.vals[node.slot]
+    except IndexError:
+        val = unbound
+    if val is unbound: return env.outer.get(node.name)
+    return val
+
+def cached_global(node):
+    if node.version == repl_env.version:
+        stats['global-hits'] += 1
+        return node.value
+    stats['global-misses'] += 1
+    node.value, node.version = lookup_global(node.name), repl_env.version
+    return node.value
+
+def lookup_dynamic(node, env):
+    if local_name(node.name, node.scopes): return env.get(node.name)
+    return cached_global(node)
+
+def macro_expansion(node):
+    """The node the MacroCall node runs, expanded again if the name it calls
+    has been bound to another value since it was last expanded."""
+    current = repl_env.data.get(node.form[0])
+    if node.expansion is None or current is not node.macro:
+        node.macro = current
+        if types._macro_Q(current):
+            node.expansion = expand(current, node.form, node.scope)
         else:
-            el = eval_ast(ast, env)
-            f = el[0]
-            if hasattr(f, '__ast__'):
-                ast = f.__ast__
-                env = f.__gen_env__(el[1:])
-            else:
-                return f(*el[1:])
+            node.expansion = resolve(node.form, node.scope)
+    elif types._macro_Q(current):
+        stats['macro-hits'] += 1
+    return node.expansion
+
+def node_items(node):
+    if type(node) is VectorNode: return node.items
+    if type(node) is HashMapNode: return node.vals
+    return node.args
+
+def build(node, vals):
+    if type(node) is VectorNode: return types._vector(*vals)
+    if type(node) is HashMapNode: return types.Hash_Map(zip(node.keys, vals))
+    return eval(node.name)(*vals)
+
+def run_node(node, env):
+    konts = []
+    while True:
+        try:
+            while True:
+                # Evaluate node, to a value or by pushing a frame for the
+                # rest of it and moving on to its first part
+                t = type(node)
+                if t is Const:
+                    val = node.value
+                elif t is Local:
+                    if node.bound and node.depth == 0: val = env.vals[node.slot]
+                    else:                              val = lookup_local(node, env)
+                elif t is Global:
+                    val = cached_global(node)
+                elif t is Dynamic:
+                    val = lookup_dynamic(node, env)
+                elif t is Call:
+                    konts.append([K_CALL, node, env, []])
+                    node = node.fn
+                    continue
+                elif t is MacroCall:
+                    node = macro_expansion(node)
+                    continue
+                elif t is If:
+                    konts.append([K_IF, node, env])
+                    node = node.test
+                    continue
+                elif t is Do:
+                    if node.forms:
+                        konts.append([K_DO, node, env, 0])
+                        node = node.forms[0]
+                    else:
+                        node = node.last
+                    continue
+                elif t is Let:
+                    env = Frame(env, node.scope, [unbound] * len(node.scope.names))
+                    if node.inits:
+                        konts.append([K_LET, node, env, 0])
+                        node = node.inits[0][1]
+                    else:
+                        node = node.body
+                    continue
+                elif t is Fn:
+                    val = types._function(run_node, node.bind, node.body, env, node)
+                elif t is Def:
+                    konts.append([K_DEF, node, env])
+                    node = node.value
+                    continue
+                elif t is Try:
+                    if node.handler is not None: konts.append([K_TRY, node, env])
+                    node = node.body
+                    continue
+                elif t is VectorNode or t is HashMapNode or t is Interop:
+                    items = node_items(node)
+                    if items:
+                        konts.append([K_ITEMS, node, env, []])
+                        node = items[0]
+                        continue
+                    val = build(node, [])
+                elif t is MacroExpand:
+                    val = macroexpand(node.form, env)
+                elif t is PyExec:
+                    exec(compile(node.code, '', 'single'), globals())
+                    val = None
+                else:
+                    val = types.py_to_mal(eval(node.code))
+
+                # Hand val to the innermost pending frame
+                while konts:
+                    k = konts[-1]
+                    tag = k[0]
+                    if tag is K_CALL:
+                        node, argv = k[1], k[3]
+                        argv.append(val)
+                        if len(argv) == 1 and type(val) is types.MalFunction and val.is_macro:
+                            konts.pop()
+                            node, env = expand(val, node.form, node.scope), k[2]
+                            break
+                        if len(argv) <= len(node.args):
+                            node, env = node.args[len(argv) - 1], k[2]
+                            break
+                        konts.pop()
+                        f = argv[0]
+                        if type(f) is types.MalFunction:
+                            if len(konts) >= max_depth:
+                                raise types.MalException(
+                                    "maximum evaluation depth exceeded (%d)" % max_depth)
+                            node, env = f.ast, f._Env(f.env, f.params, argv[1:])
+                            break
+                        val = f(*argv[1:])
+                    elif tag is K_IF:
+                        konts.pop()
+                        node, env = k[1], k[2]
+                        node = node.else_ if val is None or val is False else node.then
+                        break
+                    elif tag is K_DO:
+                        node, env, i = k[1], k[2], k[3] + 1
+                        if i < len(node.forms):
+                            k[3] = i
+                            node = node.forms[i]
+                        else:
+                            konts.pop()
+                            node = node.last
+                        break
+                    elif tag is K_LET:
+                        node, env, i = k[1], k[2], k[3]
+                        env.vals[node.inits[i][0]] = val
+                        i += 1
+                        if i < len(node.inits):
+                            k[3] = i
+                            node = node.inits[i][1]
+                        else:
+                            konts.pop()
+                            node = node.body
+                        break
+                    elif tag is K_DEF:
+                        konts.pop()
+                        if k[1].macro:
+                            val = types._clone(val)
+                            val.is_macro = True
+                        val = k[2].set(k[1].name, val)
+                    elif tag is K_TRY:
+                        konts.pop()
+                    else:
+                        node, vals = k[1], k[3]
+                        vals.append(val)
+                        items = node_items(node)
+                        if len(vals) < len(items):
+                            node, env = items[len(vals)], k[2]
+                            break
+                        konts.pop()
+                        val = build(node, vals)
+                else:
+                    return val
+        except Exception as exc:
+            while konts and konts[-1][0] is not K_TRY:
+                konts.pop()
+            if not konts: raise
+            k = konts.pop()
+            if isinstance(exc, types.MalException): err = exc.object
+            else:                                   err = exc.args[0]
+            node, env = k[1].handler, Frame(k[2], k[1].scope, [err])
+
+# bytecode
+# When MAL_EVAL is "vm", resolved nodes are compiled into Code: a flat list
+# of instructions, each an opcode followed by one integer argument, and a
+# constant pool the arguments index.  run_code runs it in a single dispatch
+# loop over a value stack, and keeps the caller's code, position and env
+# in a list of frames while it runs a MalFunction, so calls take no Python
+# stack either, and past MAL_MAX_DEPTH frames a call raises a MalException.
+# A call in tail position replaces the running code instead.
+#
+# A fn* body is compiled once, when the fn* is, into the Code its
+# MalFunctions share.  GLOBAL and CALLG keep the value they found in a
+# cell of the pool, with the repl_env version, as analyze_global does.
+# CALLG loads the head of a call of a Global and, when the head turns out
+# to be a macro, runs the expansion in place of the call.  MACRO keeps the
+# code of an expansion in its cell for as long as the name is bound to the
+# same macro.  The rare nodes with no instruction of their own, macroexpand,
+# py!*, py* and its like, are handed to run_node.
+
+vm_eval = os.environ.get('MAL_EVAL') == 'vm'
+
+(LOCAL0, LOCAL1, LOCAL, CONST, GLOBAL, CALLG, CALL, TAILCALL, RETURN,
+ JUMP, JUMPF, POP, LET, SETLOCAL, LEAVE, CLOSURE, DEF, TRY, ENDTRY, CATCH,
+ MACRO, VECTOR, HASHMAP, INTEROP, DYNAMIC, NODE) = range(26)
+
+class Code(object):
+    __slots__ = ('ops', 'consts')
+    def __init__(self): self.ops, self.consts = [], []
+
+    def emit(self, op, arg=0):
+        self.ops += (op, arg)
+        return len(self.ops) - 1   # where arg is, to patch a jump
+
+    def const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+def compile_local(node, code, tail):
+    if node.bound and node.depth == 0:   code.emit(LOCAL0, node.slot)
+    elif node.bound and node.depth == 1: code.emit(LOCAL1, node.slot)
+    else:                                code.emit(LOCAL, code.const(node))
+
+def compile_call(node, code, tail):
+    if type(node.fn) is Global or type(node.fn) is Dynamic:
+        # name, version, value, the call, tail?, macro, expansion, pc after,
+        # the value or its arith.binary entry, which CALLG pushes, and the
+        # scopes of a Dynamic
+        scopes = node.fn.scopes if type(node.fn) is Dynamic else ()
+        cell = [node.fn.name, -1, None, node, tail, None, None, 0, None, scopes]
+        code.emit(CALLG, code.const(cell))
+    else:
+        compile_node(node.fn, code)
+        cell = None
+    for arg in node.args: compile_node(arg, code)
+    code.emit(TAILCALL if tail else CALL, len(node.args))
+    if cell: cell[7] = len(code.ops)
+
+def compile_macro_call(node, code, tail):
+    # the call, version, macro, expansion, expanded?, tail?
+    if node.expansion is None:
+        cell = [node, -1, None, None, False, tail]
+    else:
+        cell = [node, repl_env.version, node.macro,
+                compile_code(node.expansion), True, tail]
+    code.emit(MACRO, code.const(cell))
+
+def compile_if(node, code, tail):
+    compile_node(node.test, code)
+    else_at = code.emit(JUMPF)
+    compile_node(node.then, code, tail)
+    if not tail: end_at = code.emit(JUMP)
+    code.ops[else_at] = len(code.ops)
+    compile_node(node.else_, code, tail)
+    if not tail: code.ops[end_at] = len(code.ops)
+
+def compile_do(node, code, tail):
+    for form in node.forms:
+        compile_node(form, code)
+        code.emit(POP)
+    compile_node(node.last, code, tail)
+
+def compile_let(node, code, tail):
+    code.emit(LET, code.const(node.scope))
+    for slot, init in node.inits:
+        compile_node(init, code)
+        code.emit(SETLOCAL, slot)
+    compile_node(node.body, code, tail)
+    if not tail: code.emit(LEAVE)
+
+def compile_def(node, code, tail):
+    compile_node(node.value, code)
+    code.emit(DEF, code.const(node))
+
+def compile_try(node, code, tail):
+    if node.handler is None:
+        compile_node(node.body, code, tail)
+        return
+    handler_at = code.emit(TRY)
+    compile_node(node.body, code)
+    code.emit(ENDTRY)
+    if tail: code.emit(RETURN)
+    else:    end_at = code.emit(JUMP)
+    code.ops[handler_at] = len(code.ops)
+    code.emit(CATCH, code.const(node.scope))
+    compile_node(node.handler, code, tail)
+    if not tail:
+        code.emit(LEAVE)
+        code.ops[end_at] = len(code.ops)
+
+def compile_items(op, key):
+    def compile_(node, code, tail):
+        for item in node_items(node): compile_node(item, code)
+        code.emit(op, code.const(key(node)))
+    return compile_
+
+compilers = {
+    Const:       lambda node, code, tail: code.emit(CONST, code.const(node.value)),
+    Local:       compile_local,
+    Global:      lambda node, code, tail: code.emit(GLOBAL, code.const([node.name, -1, None])),
+    Dynamic:     lambda node, code, tail: code.emit(
+                     DYNAMIC, code.const([node.name, -1, None, node.scopes])),
+    Call:        compile_call,
+    MacroCall:   compile_macro_call,
+    If:          compile_if,
+    Do:          compile_do,
+    Let:         compile_let,
+    Fn:          lambda node, code, tail: code.emit(
+                     CLOSURE, code.const((node, compile_code(node.body)))),
+    Def:         compile_def,
+    Try:         compile_try,
+    VectorNode:  compile_items(VECTOR, lambda node: len(node.items)),
+    HashMapNode: compile_items(HASHMAP, lambda node: node.keys),
+    Interop:     compile_items(INTEROP, lambda node: node),
+}
+
+# Nodes whose compiler ends them itself when they are in tail position
+tail_compiled = (Call, MacroCall, If, Do, Let, Try)
+
+def compile_node(node, code, tail=False):
+    compile_ = compilers.get(type(node))
+    if compile_: compile_(node, code, tail)
+    else:        code.emit(NODE, code.const(node))
+    if tail and type(node) not in tail_compiled: code.emit(RETURN)
+
+def compile_code(node):
+    code = Code()
+    compile_node(node, code, True)
+    return code
+
+def global_cell(cell):
+    """Look the name of a GLOBAL or CALLG cell up in repl_env again."""
+    stats['global-misses'] += 1
+    cell[2], cell[1] = lookup_global(cell[0]), repl_env.version
+    return cell[2]
+
+def dynamic_cell(cell, env, scopes):
+    """Look the name of a DYNAMIC or CALLG cell up, caching it only if it
+    is a global."""
+    if local_name(cell[0], scopes): return env.get(cell[0])
+    return global_cell(cell)
+
+def call_cell(cell, env):
+    """Look the head of a CALLG cell up again, and what to call."""
+    f = dynamic_cell(cell, env, cell[9])
+    op = arith.binary.get(id(f)) if len(cell[3].args) == 2 else None
+    cell[8] = op or f
+    return cell[8]
+
+def macro_code(cell):
+    """The code a MACRO cell runs, as compile_macro_call and
+    analyze_macro_call keep it."""
+    if cell[1] != repl_env.version:
+        cell[1] = repl_env.version
+        node = cell[0]
+        current = repl_env.data.get(node.form[0])
+        if cell[3] is None or current is not cell[2]:
+            cell[2], cell[4] = current, types._macro_Q(current)
+            if cell[4]: expansion = expand(current, node.form, node.scope)
+            else:       expansion = resolve(node.form, node.scope)
+            cell[3] = compile_code(expansion)
+            return cell[3]
+    if cell[4]: stats['macro-hits'] += 1
+    return cell[3]
+
+def depth_error():
+    raise types.MalException("maximum evaluation depth exceeded (%d)" % max_depth)
+
+def run_code(code, env):
+    ops, consts, pc = code.ops, code.consts, 0
+    stack, frames, handlers = [], [], []
+    push, pop = stack.append, stack.pop
+    MalFunction = types.MalFunction
+    while True:
+        try:
+            while True:
+                op, arg = ops[pc], ops[pc+1]
+                pc += 2
+                if op == CALLG:
+                    cell = consts[arg]
+                    if cell[1] == repl_env.version:
+                        stats['global-hits'] += 1
+                        f = cell[8]
+                    else:
+                        f = call_cell(cell, env)
+                    if type(f) is MalFunction and f.is_macro:
+                        if cell[5] is not f:
+                            node = cell[3]
+                            cell[5] = f
+                            cell[6] = compile_code(expand(f, node.form, node.scope))
+                        else:
+                            stats['macro-hits'] += 1
+                        if not cell[4]:
+                            if len(frames) >= max_depth: depth_error()
+                            frames.append((ops, consts, cell[7], env))
+                        ops, consts, pc = cell[6].ops, cell[6].consts, 0
+                    else:
+                        push(f)
+                elif op == LOCAL0:
+                    push(env.vals[arg])
+                elif op == CALL or op == TAILCALL:
+                    if arg == 2:
+                        b, a = pop(), pop()
+                        f = pop()
+                        if type(f) is not MalFunction:
+                            # Mostly the arith.binary entries CALLG pushes
+                            push(f(a, b))
+                            if op == TAILCALL:
+                                if not frames: return pop()
+                                ops, consts, pc, env = frames.pop()
+                            continue
+                        args = [a, b]
+                    else:
+                        if arg == 1:
+                            args = [pop()]
+                        else:
+                            n = len(stack) - arg
+                            args = stack[n:]
+                            del stack[n:]
+                        f = pop()
+                    if type(f) is MalFunction:
+                        frame = f._Env(f.env, f.params, args)
+                        if op == CALL:
+                            if len(frames) >= max_depth: depth_error()
+                            frames.append((ops, consts, pc, env))
+                        ops, consts, pc, env = f.ast.ops, f.ast.consts, 0, frame
+                    else:
+                        push(f(*args))
+                        if op == TAILCALL:
+                            if not frames: return pop()
+                            ops, consts, pc, env = frames.pop()
+                elif op == CONST:
+                    push(consts[arg])
+                elif op == GLOBAL:
+                    cell = consts[arg]
+                    if cell[1] == repl_env.version:
+                        stats['global-hits'] += 1
+                        push(cell[2])
+                    else:
+                        push(global_cell(cell))
+                elif op == JUMPF:
+                    val = pop()
+                    if val is None or val is False: pc = arg
+                elif op == RETURN:
+                    if not frames: return pop()
+                    ops, consts, pc, env = frames.pop()
+                elif op == LOCAL1:
+                    push(env.outer.vals[arg])
+                elif op == LOCAL:
+                    push(lookup_local(consts[arg], env))
+                elif op == DYNAMIC:
+                    cell = consts[arg]
+                    if cell[1] == repl_env.version:
+                        stats['global-hits'] += 1
+                        push(cell[2])
+                    else:
+                        push(dynamic_cell(cell, env, cell[3]))
+                elif op == JUMP:
+                    pc = arg
+                elif op == POP:
+                    pop()
+                elif op == LET:
+                    scope = consts[arg]
+                    env = Frame(env, scope, [unbound] * len(scope.names))
+                elif op == SETLOCAL:
+                    env.vals[arg] = pop()
+                elif op == LEAVE:
+                    env = env.outer
+                elif op == CLOSURE:
+                    node, body = consts[arg]
+                    push(types._function(run_code, node.bind, body, env, node))
+                elif op == DEF:
+                    node, val = consts[arg], pop()
+                    if node.macro:
+                        val = types._clone(val)
+                        val.is_macro = True
+                    push(env.set(node.name, val))
+                elif op == MACRO:
+                    cell = consts[arg]
+                    body = macro_code(cell)
+                    if not cell[5]:
+                        if len(frames) >= max_depth: depth_error()
+                        frames.append((ops, consts, pc, env))
+                    ops, consts, pc = body.ops, body.consts, 0
+                elif op == TRY:
+                    handlers.append((len(frames), len(stack), ops, consts, arg, env))
+                elif op == ENDTRY:
+                    handlers.pop()
+                elif op == CATCH:
+                    env = Frame(env, consts[arg], [pop()])
+                elif op == VECTOR:
+                    n = len(stack) - consts[arg]
+                    val = types._vector(*stack[n:])
+                    del stack[n:]
+                    push(val)
+                elif op == HASHMAP:
+                    keys = consts[arg]
+                    n = len(stack) - len(keys)
+                    val = types.Hash_Map(zip(keys, stack[n:]))
+                    del stack[n:]
+                    push(val)
+                elif op == INTEROP:
+                    node = consts[arg]
+                    n = len(stack) - len(node.args)
+                    val = eval(node.name)(*stack[n:])
+                    del stack[n:]
+                    push(val)
+                else:
+                    push(run_node(consts[arg], env))
+        except Exception as exc:
+            if not handlers: raise
+            n, sp, ops, consts, pc, env = handlers.pop()
+            del frames[n:]
+            del stack[sp:]
+            if isinstance(exc, types.MalException): push(exc.object)
+            else:                                   push(exc.args[0])
+
+# eval
+def EVAL(ast, env):
+    node = resolve(ast, env.scope if type(env) is Frame else None)
+    if stack_eval: return run_node(node, env)
+    if vm_eval: return run_code(compile_code(node), env)
+    return run(analyze(node, True), env)
 
 # print
 def PRINT(exp):
@@ -154,31 +1112,45 @@ repl_env = Env()
 def REP(str):
     return PRINT(EVAL(READ(str), repl_env))
 
+# evaluate each top-level form of a file as soon as it has been read
+def load_file(f):
+    for ast in reader.read_file_forms(f):
+        EVAL(ast, repl_env)
+    return None
+
 # core.py: defined using python
 for k, v in core.ns.items(): repl_env.set(types._symbol(k), v)
 repl_env.set(types._symbol('eval'), lambda ast: EVAL(ast, repl_env))
+repl_env.set(types._symbol('load-file'), load_file)
+repl_env.set(types._symbol('eval-stats'), eval_stats)
 repl_env.set(types._symbol('*ARGV*'), types._list(*sys.argv[2:]))
 
 # core.mal: defined using the language itself
 REP("(def! *host-language* \"python\")")
 REP("(def! not (fn* (a) (if a false true)))")
-REP("(def! load-file (fn* (f) (eval (read-string (str \"(do \" (slurp f) \"\nnil)\")))))")
+REP("(defmacro! lazy-seq (fn* (& body) `(lazy-seq* (fn* () (do ~@body)))))")
 REP("(defmacro! cond (fn* (& xs) (if (> (count xs) 0) (list 'if (first xs) (if (> (count xs) 1) (nth xs 1) (throw \"odd number of forms to cond\")) (cons 'cond (rest (rest xs)))))))")
 
 if len(sys.argv) >= 2:
+    # A script's output is buffered unless it goes to a terminal
+    if 'MAL_OUTPUT' not in os.environ:
+        core.output.batch = not sys.stdout.isatty()
     REP('(load-file "' + sys.argv[1] + '")')
+    if os.environ.get('MAL_STATS'):
+        core.flush()
+        print(PRINT(eval_stats()), file=sys.stderr)
     sys.exit(0)
 
 # repl loop
 REP("(println (str \"Mal [\" *host-language* \"]\"))")
 while True:
     try:
-        line = mal_readline.readline("user> ")
+        line = core.readline("user> ")
         if line == None: break
         if line == "": continue
-        print(REP(line))
+        print(REP(line), file=core.output)
     except reader.Blank: continue
     except types.MalException as e:
-        print("Error:", printer._pr_str(e.object))
+        print("Error:", printer._pr_str(e.object), file=core.output)
     except Exception as e:
-        print("".join(traceback.format_exception(*sys.exc_info())))
+        print("".join(traceback.format_exception(*sys.exc_info())), file=core.output)